@@ -18,6 +18,8 @@ def parse_args():
     general.add_argument('-fasta', help='unaligned fasta format data to add')
     general.add_argument('-gb', help='genbank files')
     general.add_argument('-out', help='output directory')
+    general.add_argument('-compress', action='store_true',
+                         help='compress output files (BGZF)')
     gb2fasta_ = arg.add_argument_group('GB2Fasta')
     # genes in IR regions
     gb2fasta_.add_argument('-allow_mosaic_spacer', action='store_true',
@@ -34,16 +36,52 @@ def parse_args():
     # handle rps12
     gb2fasta_.add_argument('-max_gene_len', default=20000, type=int,
                            help='maximum length of gene fragments ')
+    gb2fasta_.add_argument('-group_fasta', action='store_true',
+                           help='also write whole records grouped by gene '
+                                'names in "Fasta" folder')
+    gb2fasta_.add_argument('-select',
+                           help='file of accessions, only divide these '
+                                'records of input genbank files')
+    gb2fasta_.add_argument('-keep_features', nargs='*',
+                           help='only extract features of given names '
+                                '(regular expression) or types, e.g. '
+                                '"rbcL" "trn.*" "gene"')
     gb2fasta_.add_argument('-no_divide', action='store_true',
                            help='only download')
     # for plastid genes
     gb2fasta_.add_argument('-rename', action='store_true',
                            help='try to rename gene')
-    gb2fasta_.add_argument('-unique', choices=('longest', 'first', 'no'),
+    gb2fasta_.add_argument('-unique',
+                           choices=('longest', 'first', 'cluster', 'no'),
                            default='first',
                            help='method to remove redundant sequences')
+    gb2fasta_.add_argument('-identity', type=float, default=0.99,
+                           help='minimum identity for "-unique cluster"')
+    gb2fasta_.add_argument('-screen', action='store_true',
+                           help='remove abnormal sequences before alignment')
     gb2fasta_.add_argument('-email', type=str,
                            help='email address for querying Genbank')
+    gb2fasta_.add_argument('-api_key', type=str,
+                           help='NCBI API key, allow 10 requests per second')
+    gb2fasta_.add_argument('-resume', action='store_true',
+                           help='continue unfinished download in output '
+                                'folder')
+    gb2fasta_.add_argument('-cache', action='store_true',
+                           help='only download records not in local cache')
+    gb2fasta_.add_argument('-threads', type=int, default=1,
+                           help='number of processes for dividing')
+    gb2fasta_.add_argument('-dry_run', action='store_true',
+                           help='only estimate size and time of the query')
+    gb2fasta_.add_argument('-fetch_mode', choices=('gb', 'ft'), default='gb',
+                           help='download full genbank records, or feature '
+                                'tables and fasta')
+    gb2fasta_.add_argument('-prefilter', action='store_true',
+                           help='skip records without usable annotation '
+                                'before downloading')
+    gb2fasta_.add_argument('-partition_size', type=int, default=50000,
+                           help='split query with more records into '
+                                'sub-queries by publication date, 0 for not '
+                                'split')
     gb2fasta_.add_argument('-exclude', type=str, help='exclude option')
     gb2fasta_.add_argument('-gene', type=str, help='gene name')
     # in case of same taxonomy name in different group
@@ -69,6 +107,9 @@ def parse_args():
                                     'pl', 'plastid'),
                            default='ignore', help='organelle type')
     gb2fasta_.add_argument('-query', nargs='*', help='query text')
+    gb2fasta_.add_argument('-accession_file',
+                           help='file of accessions to download, could be '
+                                'filtered by query options')
     gb2fasta_.add_argument('-refseq', choices=('both', 'yes', 'no'),
                            default='both', help='include RefSeq or not')
     gb2fasta_.add_argument('-count', default=0, type=int,
@@ -122,7 +163,8 @@ def init_arg(arg):
     if arg.out is None:
         return None
     query = gb2fasta.get_query_string(arg, silence=True)
-    if not any([arg.gb, arg.fasta, arg.aln, arg.query, query]):
+    if not any([arg.gb, arg.fasta, arg.aln, arg.query, arg.accession_file,
+                query]):
         log.error('Empty input.')
         return None
     return arg
@@ -146,6 +188,9 @@ def cli_main():
     option = utils.arg_to_str(arg)
     log.debug(f'Options: {option}')
     arg, other_args, = gb2fasta.gb2fasta_main()
+    if arg is not None and arg.dry_run:
+        log.info('Exit.')
+        return
     log.debug(f'Options 2: {other_args}')
     arg, other_args2 = evaluate.evaluate_main()
     # if arg is None:
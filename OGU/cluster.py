@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# k-mer length, 2 bits per base, fits in uint64, should be power of 2
+K = 16
+# number of bins of one-permutation MinHash
+SKETCH_SIZE = 64
+# rows of each LSH band
+BAND_ROWS = 4
+EMPTY = np.uint64(2**64-1)
+BIN_SHIFT = np.uint64(64-int(np.log2(SKETCH_SIZE)))
+# A/C/G/T to 0/1/2/3, others to 255
+CODE = np.full(256, 255, dtype=np.uint8)
+for _n, _base in enumerate(b'ACGT'):
+    CODE[_base] = _n
+    CODE[ord(chr(_base).lower())] = _n
+
+
+def mix(x: np.ndarray) -> np.ndarray:
+    """
+    Finalizer of splitmix64, spread k-mers to the whole uint64 range.
+    """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return x
+
+
+def sketch(seq: bytes, k=K):
+    """
+    One-permutation MinHash of canonical k-mers. K-mers with ambiguous
+    bases are skipped.
+    Args:
+        seq(bytes): sequence
+        k(int): k-mer length
+    Return:
+        signature(np.ndarray or None): minimum hash of each bin, None if no
+        valid k-mer
+    """
+    codes = CODE[np.frombuffer(seq, dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return None
+    invalid = np.concatenate(([0], np.cumsum(codes == 255)))
+    valid = (invalid[k:] - invalid[:-k]) == 0
+    if not valid.any():
+        return None
+    codes = np.where(codes == 255, 0, codes).astype(np.uint64)
+    forward = codes
+    reverse = np.uint64(3) - codes
+    # double the length of k-mers each time, k should be power of 2
+    width = 1
+    while width < k:
+        shift = np.uint64(2*width)
+        forward = (forward[:-width] << shift) | forward[width:]
+        reverse = reverse[:-width] | (reverse[width:] << shift)
+        width *= 2
+    # same hash for both strands
+    kmers = np.minimum(forward, reverse)[valid]
+    hashes = np.sort(mix(kmers))
+    bins = hashes >> BIN_SHIFT
+    first = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    signature = np.full(SKETCH_SIZE, EMPTY, dtype=np.uint64)
+    signature[bins[first].astype(np.int64)] = hashes[first]
+    return signature
+
+
+def identity(signature: np.ndarray, others: np.ndarray, k=K) -> np.ndarray:
+    """
+    Estimate identity from Jaccard index of sketches, same as Mash distance.
+    Args:
+        signature(np.ndarray): one sketch
+        others(np.ndarray): sketches, one per row
+        k(int): k-mer length
+    Return:
+        identity(np.ndarray): identity to each row
+    """
+    used = (others != EMPTY) | (signature != EMPTY)
+    same = ((others == signature) & used).sum(axis=1)
+    total = np.maximum(used.sum(axis=1), 1)
+    jaccard = same / total
+    with np.errstate(divide='ignore'):
+        distance = -np.log(2*jaccard/(1+jaccard)) / k
+    return np.where(jaccard > 0, 1-distance, 0.0)
+
+
+def cluster(sequences: list, min_identity: float) -> (list, list):
+    """
+    Greedy clustering, longer sequence becomes the representative first.
+    Candidates of each sequence are found by LSH on bands of sketches, so
+    sequences are not compared with all representatives.
+    Args:
+        sequences(list): [bytes]
+        min_identity(float): minimum identity to join a cluster
+    Return:
+        representatives(list): index of representative of each sequence
+        identities(list): estimated identity to its representative
+    """
+    n = len(sequences)
+    representatives = list(range(n))
+    identities = [1.0] * n
+    signatures = [sketch(i) for i in sequences]
+    # identical sequences without sketch, i.e., too short or ambiguous
+    exact = {}
+    buckets = {}
+    order = sorted(range(n), key=lambda x: len(sequences[x]), reverse=True)
+    for index in order:
+        signature = signatures[index]
+        if signature is None:
+            key = sequences[index].upper()
+            if key in exact:
+                representatives[index] = exact[key]
+            else:
+                exact[key] = index
+            continue
+        bands = signature.reshape(-1, BAND_ROWS)
+        keys = [(i, bands[i].tobytes()) for i in
+                np.flatnonzero((bands != EMPTY).any(axis=1))]
+        # dict keeps order
+        candidates = {}
+        for key in keys:
+            for i in buckets.get(key, []):
+                candidates[i] = True
+        candidates = list(candidates)
+        if candidates:
+            scores = identity(signature,
+                              np.stack([signatures[i] for i in candidates]))
+            best = int(np.argmax(scores))
+            if scores[best] >= min_identity:
+                representatives[index] = candidates[best]
+                identities[index] = float(scores[best])
+                continue
+        # new cluster, only representatives are added to buckets
+        for key in keys:
+            buckets.setdefault(key, []).append(index)
+    return representatives, identities
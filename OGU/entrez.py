@@ -0,0 +1,560 @@
+#!/usr/bin/python3
+
+import json
+import re
+import sqlite3
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock
+from time import monotonic, sleep
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from xml.etree import ElementTree
+
+from OGU import genbank
+from OGU.global_vars import log, name
+
+# could be replaced by local server for test
+EUTILS = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# seconds
+TIMEOUT = 60
+# maximum number of ids for one epost
+EPOST_MAX = 10000
+# feature tables are small
+FT_RET_MAX = 1000
+# limits of adaptive batch size, efetch accepts at most 10000 records
+MIN_RET_MAX = 1
+MAX_RET_MAX = 10000
+# start small, in case of huge records
+START_RET_MAX = 100
+# aim of each request, big batches time out on slow connection
+TARGET_BATCH_BYTES = 8 * 1024 * 1024
+TARGET_BATCH_TIME = TIMEOUT / 4
+# retry big batch a few times before splitting it
+SPLIT_RETRY = 2
+VERSION = re.compile(rb'^VERSION\s+(\S+)', re.MULTILINE)
+ACCESSION = re.compile(rb'^ACCESSION\s+(\S+)', re.MULTILINE)
+
+
+def split_gb(data: bytes) -> list:
+    """
+    Split raw genbank data into records.
+    Return:
+        records(list): [accession.version, record], accession.version is
+        None if not found
+    """
+    records = []
+    for record in data.split(b'\n//'):
+        record = record.strip(b'\n')
+        if not record:
+            continue
+        record += b'\n//\n'
+        match = VERSION.search(record) or ACCESSION.search(record)
+        if match is None:
+            records.append([None, record])
+        else:
+            records.append([match.group(1).decode(), record])
+    return records
+
+
+class TokenBucket:
+    """
+    Limit request rate of E-utilities.
+    NCBI accepts at most 3 requests per second without API key, 10 with it.
+    Shared by all threads.
+    """
+    def __init__(self, rate: float, capacity=1):
+        self.rate = rate
+        # small capacity avoids burst
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now-self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1-self.tokens) / self.rate
+            sleep(wait)
+
+
+class BatchSize:
+    """
+    Batch size of efetch, adjusted by observed throughput.
+    It grows (at most double of the last batch) while batches are fast and
+    small, and shrinks if batches are slow or failed. The aim is
+    TARGET_BATCH_BYTES per request without exceeding TARGET_BATCH_TIME.
+    Shared by all threads.
+    """
+    def __init__(self, size: int, min_size=MIN_RET_MAX, max_size=MAX_RET_MAX):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(max_size, size))
+        # moving average of bytes per record and bytes per second
+        self.record_bytes = None
+        self.speed = None
+        self.lock = Lock()
+
+    def get(self) -> int:
+        with self.lock:
+            return self.size
+
+    def update(self, n_records: int, n_bytes: int, seconds: float) -> int:
+        """
+        Adjust size by one finished batch.
+        """
+        record_bytes = max(n_bytes, 1) / max(n_records, 1)
+        speed = max(n_bytes, 1) / max(seconds, 1e-3)
+        with self.lock:
+            if self.record_bytes is None:
+                self.record_bytes, self.speed = record_bytes, speed
+            else:
+                self.record_bytes = (self.record_bytes+record_bytes) / 2
+                self.speed = (self.speed+speed) / 2
+            target = min(TARGET_BATCH_BYTES, self.speed*TARGET_BATCH_TIME)
+            size = min(target/self.record_bytes, n_records*2)
+            self.size = int(max(self.min_size, min(self.max_size, size)))
+            return self.size
+
+    def shrink(self, n_records: int) -> int:
+        """
+        Halve size after a failed batch.
+        """
+        with self.lock:
+            self.size = max(self.min_size, min(self.size, n_records//2))
+            return self.size
+
+
+class EUtils:
+    """
+    Minimal E-utilities client.
+    Several efetch batches of one WebEnv/QueryKey could be in flight at the
+    same time, the speed is restricted by the token bucket instead of the
+    latency of each round trip.
+    """
+    def __init__(self, email='guest@example.com', api_key=None,
+                 retry_max=10):
+        self.email = email
+        self.api_key = api_key
+        self.retry_max = retry_max
+        rate = 10 if api_key is not None else 3
+        self.bucket = TokenBucket(rate)
+        # each request costs about 1 second, more workers are useless
+        self.workers = rate
+        # {taxon id: lineage}
+        self.lineages = {}
+        self.lock = Lock()
+
+    def request(self, cgi: str, **params) -> bytes:
+        """
+        Send one POST request, return raw response.
+        """
+        params['tool'] = name
+        params['email'] = self.email
+        if self.api_key is not None:
+            params['api_key'] = self.api_key
+        data = urlencode(params).encode('utf-8')
+        self.bucket.acquire()
+        with urlopen(EUTILS+cgi, data=data, timeout=TIMEOUT) as response:
+            return response.read()
+
+    def esearch(self, term: str, webenv=None) -> dict:
+        """
+        Search nuccore and keep results in history server, retry if failed.
+        Args:
+            term(str): query string, could use query keys like "#1" of
+            given WebEnv
+            webenv(str or None): existing WebEnv
+        Return:
+            query(dict): Count, WebEnv, QueryKey, IdList, QueryTranslation
+        """
+        params = {}
+        if webenv is not None:
+            params['WebEnv'] = webenv
+        retry = 0
+        while True:
+            try:
+                raw = self.request('esearch.fcgi', db='nuccore', term=term,
+                                   usehistory='y', retmode='json', **params)
+                result = json.loads(raw)['esearchresult']
+                # invalid query returns error without count
+                int(result['count'])
+                break
+            except Exception as e:
+                retry += 1
+                if retry > self.retry_max:
+                    raise RuntimeError(f'Too much failure ({self.retry_max} '
+                                       f'times) on searching.') from e
+                log.warning(f'\tFailed on searching ({e}). Retrying...')
+                sleep(1)
+        query = {'Count': result['count'],
+                 'WebEnv': result['webenv'],
+                 'QueryKey': result['querykey'],
+                 'IdList': result.get('idlist', []),
+                 'QueryTranslation': result.get('querytranslation', '')}
+        return query
+
+    def epost(self, ids: list, webenv=None) -> dict:
+        """
+        Upload ids (UID or accession.version) to history server.
+        Args:
+            ids(list): ids
+            webenv(str or None): add to existing WebEnv if given
+        Return:
+            query(dict): Count, WebEnv, QueryKey
+        """
+        params = {}
+        if webenv is not None:
+            params['WebEnv'] = webenv
+        raw = self.request('epost.fcgi', db='nuccore', id=','.join(ids),
+                           **params)
+        root = ElementTree.fromstring(raw)
+        if root.find('QueryKey') is None:
+            raise RuntimeError(f'Failed to post ids: {raw[:100]}')
+        query = {'Count': str(len(ids)),
+                 'WebEnv': root.find('WebEnv').text,
+                 'QueryKey': root.find('QueryKey').text}
+        return query
+
+    def esummary(self, query: dict, ret_start: int, ret_max: int) -> list:
+        """
+        Get document summaries of records in query.
+        Return:
+            summaries(list): [dict], keys include "accessionversion" and
+            "slen"
+        """
+        raw = self.request('esummary.fcgi', db='nuccore',
+                           webenv=query['WebEnv'],
+                           query_key=query['QueryKey'], retstart=ret_start,
+                           retmax=ret_max, retmode='json')
+        result = json.loads(raw).get('result', {})
+        return [result[i] for i in result.get('uids', []) if i in result]
+
+    def post_all(self, ids: list) -> dict:
+        """
+        Upload any number of ids, return one query for all of them.
+        Ids are posted by EPOST_MAX to the same WebEnv, then query keys are
+        combined by esearch.
+        Return:
+            query(dict): Count, WebEnv, QueryKey
+        """
+        webenv = None
+        keys = []
+        for i in range(0, len(ids), EPOST_MAX):
+            post = self.epost(ids[i:i+EPOST_MAX], webenv)
+            webenv = post['WebEnv']
+            keys.append(post['QueryKey'])
+        if len(keys) == 1:
+            return post
+        term = ' OR '.join(f'#{i}' for i in keys)
+        query = self.esearch(term, webenv)
+        return query
+
+    def get_accessions(self, query: dict, count: int) -> list:
+        """
+        Get accession.version of all records in query.
+        """
+        accessions = []
+        # plain text, quite small
+        for _, _, data in self.fetch_batches(query, count, EPOST_MAX,
+                                             rettype='acc'):
+            accessions.extend(data.decode().split())
+        return accessions
+
+    def efetch(self, query: dict, ret_start: int, ret_max: int,
+               rettype='gb', stop=None, retry_max=None) -> bytes:
+        """
+        Fetch one batch, retry if failed.
+        Incomplete GenBank batch is considered as failure, it should end with
+        "//" and have ret_max records, so ret_max should not exceed the rest
+        records of the query.
+        """
+        if retry_max is None:
+            retry_max = self.retry_max
+        retry = 0
+        while True:
+            if stop is not None and stop.is_set():
+                raise InterruptedError('Download was cancelled.')
+            try:
+                data = self.request('efetch.fcgi', db='nuccore',
+                                    webenv=query['WebEnv'],
+                                    query_key=query['QueryKey'],
+                                    rettype=rettype, retmode='text',
+                                    retstart=ret_start, retmax=ret_max)
+                if rettype == 'gb':
+                    if not data.rstrip().endswith(b'//'):
+                        raise ValueError('incomplete data')
+                    # cut at the end of one record
+                    n_records = data.count(b'\n//')
+                    if n_records != ret_max:
+                        raise ValueError(f'got {n_records} of {ret_max} '
+                                         f'records')
+                return data
+            # IOError could not handle all types of failure
+            except Exception as e:
+                retry += 1
+                if retry > retry_max:
+                    raise RuntimeError(f'Too much failure ({retry_max} '
+                                       f'times) on {ret_start}.') from e
+                log.warning(f'\tFailed on {ret_start}--{ret_start+ret_max} '
+                            f'({e}). Retrying...')
+                sleep(1)
+
+    def get_lineages(self, taxon_ids: list) -> dict:
+        """
+        Get lineages from NCBI Taxonomy, results are cached.
+        Return:
+            lineages(dict): {taxon_id(str): [names from high rank to low]}
+        """
+        with self.lock:
+            new = [i for i in set(taxon_ids) if i not in self.lineages]
+        for i in range(0, len(new), EPOST_MAX):
+            retry = 0
+            while True:
+                try:
+                    raw = self.request('efetch.fcgi', db='taxonomy',
+                                       id=','.join(new[i:i+EPOST_MAX]),
+                                       retmode='xml')
+                    root = ElementTree.fromstring(raw)
+                    break
+                except Exception as e:
+                    retry += 1
+                    if retry > self.retry_max:
+                        raise RuntimeError('Too much failure on getting '
+                                           'lineages.') from e
+                    sleep(1)
+            with self.lock:
+                for taxon in root.findall('Taxon'):
+                    lineage = (taxon.findtext('Lineage') or '').split('; ')
+                    # not in genbank records
+                    lineage = [j for j in lineage
+                               if j and j != 'cellular organisms']
+                    self.lineages[taxon.findtext('TaxId')] = lineage
+        with self.lock:
+            return {i: self.lineages.get(i, []) for i in taxon_ids}
+
+    def efetch_ft(self, query: dict, ret_start: int, ret_max: int,
+                  rettype=None, stop=None, retry_max=None) -> bytes:
+        """
+        Fetch feature tables and fasta of one batch, then join them into
+        minimal genbank records (see genbank.make_record), which are much
+        smaller than full genbank records.
+        Feature tables and sequences that do not match are considered as
+        failure, see check_ft.
+        Args:
+            same as efetch, rettype is ignored
+        """
+        if retry_max is None:
+            retry_max = self.retry_max
+        retry = 0
+        while True:
+            tables = genbank.parse_feature_table(
+                self.efetch(query, ret_start, ret_max, 'ft', stop, retry_max))
+            sequences = genbank.parse_fasta(
+                self.efetch(query, ret_start, ret_max, 'fasta', stop,
+                            retry_max))
+            try:
+                check_ft(tables, sequences)
+                break
+            except ValueError as e:
+                retry += 1
+                if retry > retry_max:
+                    raise RuntimeError(f'Too much failure ({retry_max} '
+                                       f'times) on {ret_start}.') from e
+                log.warning(f'\tFailed on {ret_start}--{ret_start+ret_max} '
+                            f'({e}). Retrying...')
+                sleep(1)
+        taxon_ids = {}
+        for accession, features in tables.items():
+            if features and features[0].type == 'source':
+                for i in features[0].qualifiers.get('db_xref', []):
+                    if i.startswith('taxon:'):
+                        taxon_ids[accession] = i[6:]
+        lineages = self.get_lineages(list(taxon_ids.values()))
+        records = []
+        for accession, sequence in sequences.items():
+            lineage = lineages.get(taxon_ids.get(accession, ''), [])
+            records.append(genbank.make_record(
+                accession, tables.get(accession, []), sequence, lineage))
+        return b''.join(records)
+
+    def fetch_batches(self, query: dict, count: int, ret_max: int,
+                      ret_start=0, rettype='gb', fetch=None, adaptive=False):
+        """
+        Keep several batches in flight, yield them in order.
+        If adaptive, batch size starts from at most START_RET_MAX and is
+        adjusted by BatchSize. A batch that keeps failing is split instead
+        of retrying the same size until retry_max is used up.
+        Args:
+            query(dict): esearch result with WebEnv and QueryKey
+            count(int): number of records to fetch
+            ret_max(int): batch size, or initial batch size if adaptive
+            ret_start(int): start position
+            rettype(str): efetch rettype
+            fetch(Callable or None): function to fetch one batch, same
+            arguments as efetch, default is efetch
+            adaptive(bool): adjust batch size or not
+        Yield:
+            ret_start(int): start of batch
+            ret_end(int): end of batch
+            data(bytes): raw data
+        """
+        if fetch is None:
+            fetch = self.efetch
+        batch_size = None
+        if adaptive:
+            batch_size = BatchSize(min(ret_max, START_RET_MAX))
+        next_start = ret_start
+        pending = deque()
+        stop = Event()
+        pool = ThreadPoolExecutor(self.workers)
+
+        def fetch_range(start: int, end: int) -> bytes:
+            if batch_size is None:
+                return fetch(query, start, end-start, rettype, stop)
+            parts = []
+            size = end - start
+            while start < end:
+                size = min(size, end-start)
+                if size > batch_size.min_size:
+                    retry_max = SPLIT_RETRY
+                else:
+                    retry_max = None
+                begin = monotonic()
+                try:
+                    data = fetch(query, start, size, rettype, stop, retry_max)
+                except RuntimeError:
+                    if retry_max is None:
+                        raise
+                    size = batch_size.shrink(size)
+                    log.warning(f'\tSplit batch {start}--{end} into '
+                                f'{size} records per request.')
+                    continue
+                batch_size.update(size, len(data), monotonic()-begin)
+                parts.append(data)
+                start += size
+            return b''.join(parts)
+
+        def submit():
+            nonlocal next_start
+            if next_start >= count:
+                return
+            size = ret_max if batch_size is None else batch_size.get()
+            start, end = next_start, min(count, next_start+size)
+            next_start = end
+            pending.append((start, end, pool.submit(fetch_range, start, end)))
+
+        try:
+            # keep the pool busy while the first batch is being written
+            for _ in range(self.workers*2):
+                submit()
+            while pending:
+                start, end, future = pending.popleft()
+                data = future.result()
+                submit()
+                yield start, end, data
+        finally:
+            stop.set()
+            for _, _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+
+def check_ft(tables: dict, sequences: dict):
+    """
+    Check feature tables and sequences of the same batch. They should have
+    the same accessions and each sequence should be as long as its source
+    feature.
+    Args:
+        tables(dict): returned by genbank.parse_feature_table
+        sequences(dict): returned by genbank.parse_fasta
+    """
+    if tables.keys() != sequences.keys():
+        missing = tables.keys() ^ sequences.keys()
+        raise ValueError(f'{len(missing)} records only have feature table '
+                         f'or sequence')
+    for accession, features in tables.items():
+        if features and features[0].type == 'source':
+            length = int(features[0].location.end)
+            if len(sequences[accession]) != length:
+                raise ValueError(f'incomplete sequence of {accession}')
+        elif not sequences[accession]:
+            raise ValueError(f'empty sequence of {accession}')
+
+
+class RecordCache:
+    """
+    Local GenBank records, keyed by accession.version.
+    Only the newest version of each accession is kept. Records are compressed
+    by zlib and stored in sqlite database.
+    Records of each fetch mode are kept in their own table, because minimal
+    records of "ft" mode could not replace full records.
+    """
+    def __init__(self, path: Path, mode='gb'):
+        """
+        Args:
+            path(Path): database file
+            mode(str): fetch mode, "gb" or "ft"
+        """
+        self.path = path
+        # old cache only has full records
+        self.table = 'record' if mode == 'gb' else f'record_{mode}'
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                          'accession TEXT PRIMARY KEY, version TEXT, '
+                          'data BLOB)')
+        self.conn.commit()
+
+    def version(self, accession_version: str):
+        accession = accession_version.split('.')[0]
+        row = self.conn.execute(
+            f'SELECT version FROM {self.table} WHERE accession = ?',
+            (accession, )).fetchone()
+        return None if row is None else row[0]
+
+    def missing(self, accession_versions: list) -> list:
+        """
+        Return records that are not cached or have new version.
+        """
+        return [i for i in accession_versions if self.version(i) != i]
+
+    def add(self, data: bytes) -> int:
+        """
+        Add raw genbank data, return number of added records.
+        """
+        n = 0
+        for accession_version, record in split_gb(data):
+            if accession_version is None:
+                continue
+            accession = accession_version.split('.')[0]
+            self.conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)',
+                (accession, accession_version, zlib.compress(record)))
+            n += 1
+        self.conn.commit()
+        return n
+
+    def get(self, accession_version: str):
+        """
+        Return raw record or None.
+        """
+        accession = accession_version.split('.')[0]
+        row = self.conn.execute(
+            f'SELECT version, data FROM {self.table} WHERE '
+            'accession = ?',
+            (accession, )).fetchone()
+        if row is None or row[0] != accession_version:
+            return None
+        return zlib.decompress(row[1])
+
+    def close(self):
+        self.conn.close()
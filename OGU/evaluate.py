@@ -17,6 +17,7 @@ from matplotlib import pyplot as plt
 from matplotlib import rcParams
 from OGU import utils
 from OGU.global_vars import log
+from OGU.output import compress_file, decompress_file, is_compressed, open_file
 # ignore warnings from numpy
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 # update matplotlib settings
@@ -36,6 +37,8 @@ def parse_args(arg_list=None):
     arg.add_argument('-out', help='output folder')
     arg.add_argument('-primer', action='store_true',
                      help='design universal primer')
+    arg.add_argument('-compress', action='store_true',
+                     help='compress alignments (BGZF)')
     options = arg.add_argument_group('Options')
     options.add_argument('-ig', '-ignore_gap', dest='ignore_gap',
                          action='store_true',
@@ -70,7 +73,8 @@ def init_arg(arg):
         for i in Path(arg.fasta_folder).glob('*'):
             arg.fasta.append(i.absolute())
     log.info('Add fasta from gb2fasta module if possible.')
-    for i in Path(arg._unique).glob('*'):
+    # skip cluster.tsv of "-unique cluster"
+    for i in Path(arg._unique).glob('*.fasta'):
         if i.name != 'Unknown.fasta':
             arg.fasta.append(i.absolute())
     if arg.fasta:
@@ -95,12 +99,14 @@ def init_arg(arg):
     return arg
 
 
-def align(files: list, folder: Path) -> (list, list):
+def align(files: list, folder: Path, compress=False) -> (list, list):
     """
     Align sequences with mafft.
+    Compressed fasta files are decompressed to temporary files at first.
     Args:
         files(list): fasta files
         folder(path): folder for output
+        compress(bool): compress alignments or not
     Returns:
         aligned(list): aligned fasta
         unaligned(list): unaligned files
@@ -119,13 +125,22 @@ def align(files: list, folder: Path) -> (list, list):
     for fasta in files:
         log.info('Aligning {}.'.format(fasta))
         out = folder / fasta.with_suffix('.aln').name
+        # mafft could not read compressed file
+        if is_compressed(fasta):
+            source = decompress_file(fasta, out.with_suffix('.tmp'))
+        else:
+            source = fasta
         with open(devnull, 'w', encoding='utf-8') as f:
             # if computer is good enough, "--genafpair" is recommended
             # where is mafft?
             _ = (f'{mafft} --auto --thread {cores} --reorder --quiet '
-                 f'--adjustdirection {fasta} > {out}')
+                 f'--adjustdirection {source} > {out}')
             m = run(_, shell=True, stdout=f, stderr=f)
+        if source != fasta:
+            source.unlink()
         if m.returncode == 0:
+            if compress:
+                compress_file(out)
             aligned.append(out)
         else:
             unaligned.append(fasta)
@@ -172,7 +187,7 @@ def fasta_to_array(aln_fasta: Path) -> (np.array, np.array):
     """
     data = []
     record = ['id', 'sequence']
-    with open(aln_fasta, 'r', encoding='utf-8') as raw:
+    with open_file(aln_fasta, 'r') as raw:
         for line in raw:
             if line.startswith('>'):
                 data.append([record[0], ''.join(record[1:])])
@@ -539,7 +554,7 @@ def evaluate_main(arg_str=None):
         log.info('Quit evaluate module.')
         return None, other_args2
     utils.add_file_log(arg)
-    aligned, unaligned = align(arg.fasta, arg._align)
+    aligned, unaligned = align(arg.fasta, arg._align, arg.compress)
     aligned.extend(arg.aln)
     evaluation_result = arg.out / 'Evaluation.csv'
     csv_head = 'Loci,' + ','.join(Variance._fields) + '\n'
@@ -2,34 +2,55 @@
 
 import argparse
 import json
-from collections import defaultdict
+import re
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy
+from datetime import date, timedelta
+from math import log2
 from io import StringIO
 from pathlib import Path
-from pkg_resources import resource_filename
-from time import sleep
+from queue import Queue
+from threading import Thread
+from time import time
 
-from Bio import Entrez, SeqIO
-from Bio.SeqFeature import SeqFeature, FeatureLocation
+from Bio import SeqIO
 
-from OGU import utils
+from OGU import genbank, taxonomy, utils
+# entrez, cluster and screen (numpy) are imported by functions that use them
+# to keep startup fast
+from OGU.output import (BgzfWriter, FastaWriter, decompress, is_compressed,
+                        open_file)
 from OGU.global_vars import log, name
 
 
-# load data
-with open(resource_filename(name, 'data/superkingdoms.csv'), 'r') as _:
-    SUPERKINGDOMS = set(_.read().split(','))
-with open(resource_filename(name, 'data/kingdoms.csv'),
-          'r') as _:
-    KINGDOMS = set(_.read().split(','))
-with open(resource_filename(name, 'data/phyla.csv'),
-          'r') as _:
-    PHYLA = set(_.read().split(','))
-with open(resource_filename(name, 'data/classes.csv'),
-          'r') as _:
-    CLASSES = set(_.read().split(','))
-with open(resource_filename(name, 'data/animal_orders.csv'),
-          'r') as _:
-    ANIMAL_ORDERS = set(_.read().split(','))
+# records
+TOO_MUCH = 50000
+# first and last day for partitioning query by publication date
+FIRST_DAY = date(1980, 1, 1)
+# number of partitions downloading at the same time
+PARTITION_WORKERS = 2
+# for dry run, number of esummary requests and sampled records
+DRY_RUN_BATCHES = 5
+DRY_RUN_SAMPLE = 500
+# size of genbank file, sequence and annotations
+GB_BYTES_PER_BASE = 1.3
+GB_BYTES_PER_RECORD = 2000
+# bytes per second, typical speed of downloading from NCBI
+DOWNLOAD_SPEED = 2 * 1024 * 1024
+# seconds, latency of each request
+REQUEST_SECONDS = 1.0
+# rough guesses, not calibrated by real runs of alignment and evaluation
+# divide speed of the computer that ALIGN_COST and EVALUATE_COST refer to
+REFERENCE_DIVIDE_SPEED = 40 * 1024 * 1024
+# seconds per base per log2(number of records)
+ALIGN_COST = 1e-6
+EVALUATE_COST = 2e-6
+# estimates that rely on the guesses above
+UNCALIBRATED = ('Align', 'Evaluate')
+# types of divided fragments, for "-keep_features"
+FRAGMENT_TYPES = genbank.ACCEPT_TYPE | {'spacer', 'mosaic_spacer', 'intron'}
 
 
 def parse_args(arg_list=None):
@@ -40,9 +61,15 @@ def parse_args(arg_list=None):
     arg.add_argument('-no_divide', action='store_true', help='only download')
     # for plastid genes
     arg.add_argument('-rename', action='store_true', help='try to rename gene')
-    arg.add_argument('-unique', choices=('longest', 'first', 'no'),
+    arg.add_argument('-unique', choices=('longest', 'first', 'cluster', 'no'),
                      default='first',
                      help='method to remove redundant sequences')
+    arg.add_argument('-identity', type=float, default=0.99,
+                     help='minimum identity for "-unique cluster"')
+    arg.add_argument('-screen', action='store_true',
+                     help='remove abnormal sequences before alignment')
+    arg.add_argument('-compress', action='store_true',
+                     help='compress output files (BGZF)')
     adv = arg.add_argument_group('Advance')
     # trnK-matK
     adv.add_argument('-allow_mosaic_spacer', action='store_true',
@@ -60,8 +87,36 @@ def parse_args(arg_list=None):
     # handle rps12
     adv.add_argument('-max_gene_len', default=20000, type=int,
                      help='maximum length of gene sequence')
+    adv.add_argument('-group_fasta', action='store_true',
+                     help='also write whole records grouped by gene names '
+                          'in "Fasta" folder')
+    adv.add_argument('-select',
+                     help='file of accessions, only divide these records of '
+                          'input genbank files')
+    adv.add_argument('-keep_features', nargs='*',
+                     help='only extract features of given names (regular '
+                          'expression) or types, e.g. "rbcL" "trn.*" "gene"')
     adv.add_argument('-email', type=str,
                      help='email address for querying Genbank')
+    adv.add_argument('-api_key', type=str,
+                     help='NCBI API key, allow 10 requests per second')
+    adv.add_argument('-resume', action='store_true',
+                     help='continue unfinished download in output folder')
+    adv.add_argument('-cache', action='store_true',
+                     help='only download records not in local cache')
+    adv.add_argument('-threads', type=int, default=1,
+                     help='number of processes for dividing')
+    adv.add_argument('-dry_run', action='store_true',
+                     help='only estimate size and time of the query')
+    adv.add_argument('-fetch_mode', choices=('gb', 'ft'), default='gb',
+                     help='download full genbank records, or feature tables '
+                          'and fasta')
+    adv.add_argument('-prefilter', action='store_true',
+                     help='skip records without usable annotation before '
+                          'downloading')
+    adv.add_argument('-partition_size', type=int, default=TOO_MUCH,
+                     help='split query with more records into sub-queries '
+                          'by publication date, 0 for not split')
     query = arg.add_argument_group('Query')
     query.add_argument('-exclude', type=str, help='exclude option')
     query.add_argument('-gene', type=str, help='gene name')
@@ -87,6 +142,9 @@ def parse_args(arg_list=None):
                                 'pl', 'plastid'),
                        default='ignore', help='organelle type')
     query.add_argument('-query', nargs='*', help='query text')
+    query.add_argument('-accession_file',
+                       help='file of accessions to download, could be '
+                            'filtered by query options')
     query.add_argument('-refseq', choices=('both', 'yes', 'no'),
                        default='both', help='include RefSeq or not')
     query.add_argument('-count', default=0, type=int,
@@ -185,9 +243,28 @@ def get_query_string(arg, silence=False):
 def init_arg(arg):
     arg.query = get_query_string(arg)
     arg = utils.init_out(arg)
-    if arg.gb is None and arg.query is None:
+    if arg.gb is None and arg.query is None and arg.accession_file is None:
         log.warning('Empty input.')
         return None
+    if arg.accession_file is not None:
+        arg.accession_file = Path(arg.accession_file).absolute()
+        if not arg.accession_file.is_file():
+            log.error(f'{arg.accession_file} does not exist or is not a '
+                      f'valid file.')
+            return None
+    if arg.select is not None:
+        arg.select = Path(arg.select).absolute()
+        if not arg.select.is_file():
+            log.error(f'{arg.select} does not exist or is not a valid file.')
+            return None
+        # downloaded records are all wanted, do not mix them
+        if arg.query is not None or arg.accession_file is not None:
+            log.error('"-select" only works on "-gb" files, use '
+                      '"-accession_file" to download given records.')
+            return None
+        arg._selected = read_accession_file(arg.select)
+        # accessions found in any input file
+        arg._selected_found = set()
     if arg.refseq and arg.gene is None:
         log.info('Reset the limitation of sequence length for RefSeq.')
         arg.min_len = None
@@ -203,129 +280,1004 @@ def init_arg(arg):
         arg.gb = list()
     if arg.no_divide:
         log.warning('Only download data because of "-no_divide"')
+    if arg.screen and arg.unique == 'no':
+        log.warning('Skip "-screen" because of "-unique no".')
+    if not 0 < arg.identity <= 1:
+        log.error('"-identity" should be in (0, 1].')
+        return None
+    if arg.threads < 1:
+        log.error('"-threads" should be positive.')
+        return None
+    # shared by all input files
+    arg._duplicates = genbank.DuplicateFilter()
+    try:
+        arg._keep_names, arg._keep_types = get_keep_filter(arg.keep_features)
+    except re.error as e:
+        log.error(f'Invalid "-keep_features": {e}.')
+        return None
     return arg
 
 
-def download(arg):
+def get_keep_filter(values):
     """
-    Download records from Genbank.
-    Because of connection to Genbank website is not stable (especially in
-    Asia), it will retry if failed. Ctrl+C to break.
+    Parse "-keep_features". Values in FRAGMENT_TYPES are feature types,
+    others are regular expressions of feature names, case-insensitive.
+    Args:
+        values(list or None): option values
+    Return:
+        names(re.Pattern or None): None if names are not limited
+        types(set): empty if types are not limited
     """
-    too_much = 50000
-    # although Bio.Entrez has max_tries, current code could handle error
-    # clearly
-    retry_max = 10
-    if arg.email is None:
-        Entrez.email = 'guest@example.com'
-        log.info(f'\tEmail address for using Entrez missing, '
-                 f'use {Entrez.email} instead.')
-    else:
-        Entrez.email = arg.email
-    query_handle = Entrez.read(Entrez.esearch(db='nuccore', term=arg.query,
-                                              usehistory='y'))
-    count = int(query_handle['Count'])
+    if not values:
+        return None, set()
+    types = {i for i in values if i in FRAGMENT_TYPES}
+    patterns = [i for i in values if i not in FRAGMENT_TYPES]
+    if not patterns:
+        return None, types
+    names = re.compile('|'.join(f'(?:{i})' for i in patterns), re.IGNORECASE)
+    return names, types
 
-    if count == 0:
-        log.warning('Got 0 record. Please check the query.')
-        log.info('Abort download.')
-        return None
-    elif count > too_much and arg.count > too_much:
-        log.warning(f'Got {count} records. May cost long time to download.')
-    else:
-        log.info(f'\tGot {count} records.')
-    if arg.count != 0:
-        if count > arg.count:
-            count = arg.count
-            log.info(f'\tDownload {arg.count} records due to "-count".')
-    log.info('\tDownloading...')
-    log.warning('\tMay be slow if connection is unstable. Ctrl+C to quit.')
+
+def is_kept(name: str, feature_type: str, arg) -> bool:
+    """
+    Check feature by "-keep_features".
+    """
+    if arg._keep_types and feature_type not in arg._keep_types:
+        return False
+    if arg._keep_names is not None and arg._keep_names.fullmatch(
+            name) is None:
+        return False
+    return True
+
+
+def get_gb_name(arg) -> str:
+    """
+    Generate name of downloaded genbank file by query options.
+    """
     name_words = []
     for i in (arg.taxon, arg.organelle, arg.gene):
         if i is not None and i not in ('both', 'ignore', 'no'):
             name_words.append(i)
     if len(name_words) != 0:
         name = utils.safe_path('-'.join(name_words)) + '.gb'
+    elif arg.accession_file is not None:
+        name = utils.safe_path(arg.accession_file.stem) + '.gb'
     else:
         name = 'sequence.gb'
-    file_name = arg._gb / name
-    output = open(file_name, 'w', encoding='utf-8')
-    ret_start = 0
-    # get ret_max
+    return name
+
+
+def get_ret_max(count: int) -> int:
+    """
+    Get batch size of efetch by number of records.
+    For downloading, it is the upper limit of initial size, then the size is
+    adjusted by entrez.BatchSize.
+    """
     bit = len(str(count)) - 2
     ret_max = min(1000, max(10, 10 ** bit))
-    retry = 0
-    while ret_start < count:
-        log.info('\t{:d}--{:d}'.format(ret_start, ret_start + ret_max))
-        # Entrez accept at most 3 times per second
-        # However, due to slow network, it's fine :)
-        try:
-            data = Entrez.efetch(db='nuccore',
-                                 webenv=query_handle['WebEnv'],
-                                 query_key=query_handle['QueryKey'],
-                                 rettype='gb',
-                                 retmode='text',
-                                 retstart=ret_start,
-                                 retmax=ret_max)
-            output.write(data.read())
-        # just retry if connection failed
-        # IOError could not handle all types of failure
-        except Exception:
-            sleep(1)
-            if retry <= retry_max:
-                log.warning('Failed on download. Retrying...')
-                retry += 1
+    return ret_max
+
+
+def make_test_record(length=20000, n_genes=20) -> bytes:
+    """
+    Generate a genbank record for measuring speed of dividing.
+    """
+    gene_len = length // n_genes // 2
+    features = ['     source          1..{}'.format(length),
+                '                     /organism="Test test"',
+                '                     /db_xref="taxon:1"']
+    for i in range(n_genes):
+        start = i * gene_len * 2 + 1
+        location = f'{start}..{start+gene_len-1}'
+        for feature_type in ('gene', 'CDS'):
+            features.append(f'     {feature_type:<16}{location}')
+            features.append(f'                     /gene="gene{i}"')
+    seq = 'ACGGTCATTA' * (length//10)
+    seq_lines = []
+    for i in range(0, len(seq), 60):
+        chunks = [seq[j:j+10] for j in range(i, min(i+60, len(seq)), 10)]
+        seq_lines.append(f'{i+1:>9} ' + ' '.join(chunks))
+    record = '\n'.join([
+        f'LOCUS       TEST0001               {length} bp    DNA     linear   '
+        f'PLN 01-JAN-2000',
+        'DEFINITION  Test test.',
+        'ACCESSION   TEST0001',
+        'VERSION     TEST0001.1',
+        'SOURCE      Test test',
+        '  ORGANISM  Test test',
+        '            Eukaryota; Viridiplantae.',
+        'FEATURES             Location/Qualifiers',
+        *features,
+        'ORIGIN',
+        *seq_lines,
+        '//', ''])
+    return record.encode('utf-8')
+
+
+def measure_divide_speed(seconds=0.5) -> float:
+    """
+    Measure speed of parsing records and extracting fragments on this
+    computer.
+    Return:
+        speed(float): bytes per second
+    """
+    record = make_test_record()
+    done = 0
+    start = time()
+    while time() - start < seconds:
+        gb_record = genbank.scan_record(record)
+        for feature in gb_record.features[1:]:
+            str(feature.extract(gb_record.seq))
+        done += len(record)
+    return done / max(time()-start, 1e-3)
+
+
+def simulate_batches(count: int, record_bytes: float, workers: int,
+                     ret_max: int):
+    """
+    Simulate batches of download, which are adjusted by entrez.BatchSize
+    in the same order as EUtils.fetch_batches. Concurrent requests share
+    DOWNLOAD_SPEED.
+    Args:
+        count(int): number of records
+        record_bytes(float): bytes of each record
+        workers(int): number of concurrent requests
+        ret_max(int): initial batch size, see get_ret_max
+    Return:
+        batches(int): number of batches
+        seconds(float): download time
+        last_size(int): batch size at the end
+    """
+    from OGU import entrez
+    batch_size = entrez.BatchSize(min(ret_max, entrez.START_RET_MAX))
+    pending = deque()
+    next_start = 0
+    batches = 0
+    total_seconds = 0.0
+
+    def submit():
+        nonlocal next_start
+        if next_start < count:
+            size = min(batch_size.get(), count-next_start)
+            pending.append(size)
+            next_start += size
+
+    for _ in range(workers*2):
+        submit()
+    while pending:
+        size = pending.popleft()
+        n_bytes = size * record_bytes
+        seconds = REQUEST_SECONDS + n_bytes/(DOWNLOAD_SPEED/workers)
+        batch_size.update(size, n_bytes, seconds)
+        total_seconds += seconds
+        batches += 1
+        submit()
+    return batches, total_seconds/workers, batch_size.get()
+
+
+def dry_run(arg):
+    """
+    Only search, estimate size of data and time of each step, without
+    downloading.
+    Divide time is measured on this computer. Align and evaluate time use
+    uncalibrated costs scaled by the divide speed, they are only rough
+    guesses.
+    Args:
+        arg: arguments
+    Return:
+        estimate(dict or None): None if failed
+    """
+    from OGU import entrez
+    log.info('Dry run. Estimate the size of query without downloading.')
+    email = arg.email if arg.email is not None else 'guest@example.com'
+    client = entrez.EUtils(email, arg.api_key)
+    try:
+        query_handle = client.esearch(arg.query)
+        count = int(query_handle['Count'])
+        if arg.count != 0:
+            count = min(count, arg.count)
+        if count == 0:
+            log.warning('Got 0 record. Please check the query.')
+            return None
+        # sample several positions if too many records
+        if count <= DRY_RUN_SAMPLE:
+            positions = [(0, count)]
+        else:
+            step = count // DRY_RUN_BATCHES
+            positions = [(i*step, DRY_RUN_SAMPLE//DRY_RUN_BATCHES)
+                         for i in range(DRY_RUN_BATCHES)]
+        summaries = []
+        for start, size in positions:
+            summaries.extend(client.esummary(query_handle, start, size))
+    except Exception as e:
+        log.critical(f'Failed to query Genbank: {e}')
+        return None
+    lengths = [int(i.get('slen', 0)) for i in summaries]
+    average = sum(lengths) / max(len(lengths), 1)
+    total_bases = average * count
+    gb_bytes = total_bases*GB_BYTES_PER_BASE + count*GB_BYTES_PER_RECORD
+    # batch size that download would reach, see entrez.BatchSize
+    batches, download_time, ret_max = simulate_batches(
+        count, gb_bytes/count, client.workers, get_ret_max(count))
+    divide_speed = measure_divide_speed()
+    divide_time = gb_bytes / divide_speed / arg.threads
+    # slower computer costs more time on alignment and evaluation
+    cpu_factor = REFERENCE_DIVIDE_SPEED / divide_speed
+    n_log = max(1.0, log2(count))
+    align_time = ALIGN_COST * total_bases * n_log * cpu_factor
+    evaluate_time = EVALUATE_COST * total_bases * n_log * cpu_factor
+    estimate = {'Query': arg.query, 'Count': count,
+                'Average length': round(average, 1),
+                'Download bytes': int(gb_bytes), 'RetMax': ret_max,
+                'Batches': batches, 'Download seconds': round(download_time),
+                'Divide seconds': round(divide_time),
+                'Align seconds': round(align_time),
+                'Evaluate seconds': round(evaluate_time),
+                'Uncalibrated': [f'{i} seconds' for i in UNCALIBRATED]}
+    log.info(f'\tQuery:\t{arg.query}')
+    log.info(f'\tRecords:\t{count} (average length {average:.0f} bp, '
+             f'from {len(lengths)} summaries)')
+    log.info(f'\tDownload:\t{gb_bytes/1024/1024:.1f} MB in {batches} '
+             f'batches of up to {ret_max} records')
+    for step_name in ('Download', 'Divide', 'Align', 'Evaluate'):
+        note = ' (uncalibrated guess)' if step_name in UNCALIBRATED else ''
+        log.info(f'\t{step_name} time:\t'
+                 f'{estimate[step_name+" seconds"]/60:.1f} minutes{note}')
+    if count > TOO_MUCH:
+        log.warning(f'Got {count} records. May cost long time to download. '
+                    f'Consider to narrow the query.')
+    json_file = arg._tmp / 'DryRun.json'
+    with open(json_file, 'w', encoding='utf-8') as _:
+        json.dump(estimate, _, indent=4, sort_keys=True)
+    log.info(f'The estimate was dumped into {json_file}')
+    return estimate
+
+
+def prefilter(client, query_handle: dict, count: int, arg, kept_file=None):
+    """
+    Before downloading, remove records that would not be divided into any
+    fragment by their feature tables, which are much smaller than genbank
+    records. Records without supported annotation (only go to
+    "Unknown.fasta") or whose features are all longer than "-max_gene_len"
+    are removed.
+    Args:
+        client(EUtils): client
+        query_handle(dict): esearch result
+        count(int): number of records to check
+        arg: arguments
+        kept_file(Path or None): if given, write kept accessions into it for
+        searching again on "-resume"
+    Return:
+        query_handle(dict or None): query of kept records, None if failed
+        or no record left
+        count(int): number of kept records, -1 if failed
+    """
+    from OGU import entrez
+    log.info('\tChecking annotations of records before downloading...')
+    accept_type = genbank.ACCEPT_TYPE
+    kept = []
+    try:
+        for _, _, data in client.fetch_batches(
+                query_handle, count, entrez.FT_RET_MAX, rettype='ft'):
+            for accession, features in genbank.parse_feature_table(
+                    data).items():
+                for feature in features:
+                    if (feature.type in accept_type and
+                            genbank.NAME_KEYS & set(feature.qualifiers) and
+                            len(feature) <= arg.max_gene_len):
+                        kept.append(accession)
+                        break
+    except RuntimeError as e:
+        log.critical(str(e))
+        return None, -1
+    log.info(f'\t{len(kept)} of {count} records have usable annotations.')
+    if not kept:
+        return None, 0
+    if len(kept) == count:
+        return query_handle, count
+    if kept_file is not None:
+        kept_file.write_text('\n'.join(kept)+'\n', encoding='utf-8')
+    query_handle = client.post_all(kept)
+    return query_handle, len(kept)
+
+
+def read_accession_file(accession_file: Path) -> list:
+    """
+    Read accessions separated by space, comma or new line. Lines start with
+    "#" are ignored. Duplicate accessions are removed and the order is kept.
+    """
+    accessions = []
+    with open(accession_file, 'r', encoding='utf-8') as _:
+        for line in _:
+            if line.startswith('#'):
                 continue
+            accessions.extend(line.replace(',', ' ').split())
+    return list(dict.fromkeys(accessions))
+
+
+def post_accessions(client, accessions: list, query=None) -> dict:
+    """
+    Upload accessions to history server by batch.
+    Args:
+        client(EUtils): client
+        accessions(list): accession or accession.version
+        query(str or None): if given, only keep records match the query
+    Return:
+        query_handle(dict): same as EUtils.esearch
+    """
+    post = client.post_all(accessions)
+    term = f'#{post["QueryKey"]}'
+    if query is not None:
+        term = f'{term} AND ({query})'
+    # count of found records instead of given accessions
+    return client.esearch(term, post['WebEnv'])
+
+
+def search(client, query=None, accession_file=None) -> dict:
+    """
+    Search query, or upload accessions in the file and search query in
+    them.
+    Return:
+        query_handle(dict): same as EUtils.esearch
+    """
+    if accession_file is None:
+        return client.esearch(query)
+    accessions = read_accession_file(accession_file)
+    return post_accessions(client, accessions, query)
+
+
+def refresh_query(client, checkpoint: dict, label='') -> bool:
+    """
+    WebEnv and QueryKey on the history server expire after hours. Before
+    resuming, search again and replace them if the number of records does
+    not change.
+    Args:
+        client(EUtils): client
+        checkpoint(dict): checkpoint of the download
+        label(str): prefix of log
+    Return:
+        ok(bool): False if failed or records changed
+    """
+    accession_file = checkpoint.get('Accessions')
+    if accession_file is not None:
+        accession_file = Path(accession_file)
+    try:
+        query_handle = search(client, checkpoint.get('Search',
+                                                     checkpoint['Query']),
+                              accession_file)
+    except (RuntimeError, OSError) as e:
+        log.critical(f'{label}{e}')
+        return False
+    total = checkpoint.get('Total', checkpoint['Count'])
+    count = int(query_handle['Count'])
+    if count != total:
+        log.critical(f'{label}Number of records changed from {total} to '
+                     f'{count}. Please start a new download without '
+                     f'"-resume".')
+        return False
+    checkpoint['WebEnv'] = query_handle['WebEnv']
+    checkpoint['QueryKey'] = query_handle['QueryKey']
+    return True
+
+
+def write_checkpoint(checkpoint: dict, checkpoint_file: Path) -> Path:
+    """
+    Write checkpoint to temporary file then replace the old one, in case of
+    broken checkpoint if interrupted.
+    """
+    tmp = checkpoint_file.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as _:
+        json.dump(checkpoint, _, indent=4, sort_keys=True)
+    tmp.replace(checkpoint_file)
+    return checkpoint_file
+
+
+def read_checkpoint(checkpoint_file: Path, query: str):
+    """
+    Read checkpoint of previous download.
+    Return:
+        checkpoint(dict or None): None if not available
+    """
+    if not checkpoint_file.exists():
+        log.warning(f'Cannot find {checkpoint_file}. Start a new download.')
+        return None
+    with open(checkpoint_file, 'r', encoding='utf-8') as _:
+        checkpoint = json.load(_)
+    if checkpoint['Query'] != query:
+        log.warning('The query changed. Start a new download.')
+        return None
+    # merged file of partitions does not exist before finished
+    if 'Partitions' in checkpoint and not checkpoint['Finished']:
+        return checkpoint
+    gb_file = Path(checkpoint['File'])
+    if not gb_file.exists() or gb_file.stat().st_size < checkpoint['Offset']:
+        log.warning(f'{gb_file} is missing or broken. '
+                    f'Start a new download.')
+        return None
+    return checkpoint
+
+
+def cached_download(client, query_handle: dict, count: int, file_name: Path,
+                    ret_max: int, pipe=None, fetch=None, compress=False,
+                    mode='gb'):
+    """
+    Only download records that are not in local cache or have new version,
+    then write all records in the order of the query.
+    The cache itself keeps the progress, so "-resume" is not needed.
+    Written data is also sent to pipe if given.
+    Records are fetched by "fetch", see entrez.EUtils.fetch_batches, and
+    are cached separately by fetch mode "mode".
+    Return:
+        file_name(Path or None): None if failed
+    """
+    from OGU import entrez
+    ok, third_party = utils.get_third_party_path()
+    if not ok:
+        return None
+    cache = entrez.RecordCache(third_party / 'genbank_cache.sqlite', mode)
+    try:
+        accessions = client.get_accessions(query_handle, count)
+        missing = cache.missing(accessions)
+        log.info(f'\t{len(accessions)-len(missing)} records were found in '
+                 f'local cache, {len(missing)} records to download.')
+        for i in range(0, len(missing), entrez.EPOST_MAX):
+            ids = missing[i:i+entrez.EPOST_MAX]
+            # removed records are not returned, use the count of found ones
+            post = post_accessions(client, ids)
+            for start, end, data in client.fetch_batches(
+                    post, int(post['Count']), ret_max, fetch=fetch,
+                    adaptive=True):
+                log.info('\t{:d}--{:d}'.format(i+start, i+end))
+                cache.add(data)
+    except RuntimeError as e:
+        log.critical(str(e))
+        log.info('Abort download. Downloaded records were cached.')
+        cache.close()
+        return None
+    not_found = 0
+    with open_file(file_name, 'wb', compress) as output:
+        for accession in accessions:
+            record = cache.get(accession)
+            if record is None:
+                not_found += 1
             else:
-                log.critical(f'Too much failure ({retry_max} times).')
-                log.info('Abort download.')
+                output.write(record)
+                if pipe is not None:
+                    pipe.put(record)
+    cache.close()
+    if not_found != 0:
+        log.warning(f'\t{not_found} records were not returned by Genbank.')
+    return file_name
+
+
+def send_file(file_name: Path, size: int, pipe, chunk=1024*1024*16) -> int:
+    """
+    Send first "size" bytes of existing file to pipe.
+    Compressed file is decompressed, "size" is the size of compressed data.
+    Return:
+        sent(int): sent bytes
+    """
+    sent = 0
+    if pipe is None:
+        return sent
+
+    def read_chunks():
+        nonlocal sent
+        with open(file_name, 'rb') as _:
+            while sent < size:
+                data = _.read(min(chunk, size-sent))
+                if not data:
+                    break
+                sent += len(data)
+                yield data
+
+    if is_compressed(file_name):
+        for data in decompress(read_chunks()):
+            if data:
+                pipe.put(data)
+    else:
+        for data in read_chunks():
+            pipe.put(data)
+    return sent
+
+
+def pipe_data(pipe):
+    """
+    Yield downloaded data in pipe, stop when got None.
+    """
+    while True:
+        data = pipe.get()
+        if data is None:
+            break
+        yield data
+
+
+def divide_pipe(pipe, gbfile: Path, arg, result: list):
+    """
+    Divide records in pipe while downloading.
+    If failed, keep receiving data to avoid blocking the download.
+    Args:
+        pipe(Queue): downloaded data, end with None
+        gbfile(Path): downloaded genbank file
+        arg: arguments
+        result(list): put exception in it if failed
+    """
+    data = pipe_data(pipe)
+    try:
+        divide(gbfile, arg, clean_gb(gbfile, data, arg._duplicates))
+    except Exception as e:
+        log.critical(f'Failed to divide {gbfile} while downloading: {e}')
+        result.append(e)
+        for _ in data:
+            pass
+    return
+
+
+def pdat_query(query: str, first: date, last: date) -> str:
+    """
+    Restrict query to records published in [first, last].
+    """
+    return (f'({query}) AND ("{first:%Y/%m/%d}"[PDAT] : '
+            f'"{last:%Y/%m/%d}"[PDAT])')
+
+
+def partition_query(client, query: str, count: int, size: int) -> list:
+    """
+    Split query into disjoint sub-queries by publication date. The date
+    range is halved until each part has at most "size" records or only has
+    one day.
+    Args:
+        client(EUtils): client
+        query(str): query string
+        count(int): number of records of the query
+        size(int): maximum number of records of each part
+    Return:
+        partitions(list): [[query(str), count(int)]], in the order of date
+    """
+    log.info(f'\tSplit the query into parts with at most {size} records.')
+    partitions = []
+    today = date.today()
+    # stack, earlier date on the top
+    parts = [(FIRST_DAY, today, count)]
+    while parts:
+        first, last, n = parts.pop()
+        if n <= size or first == last:
+            if n != 0:
+                partitions.append([pdat_query(query, first, last), n])
+            continue
+        middle = first + (last-first) // 2
+        for a, b in ((middle+timedelta(days=1), last), (first, middle)):
+            sub_count = int(client.esearch(pdat_query(query, a, b))['Count'])
+            parts.append((a, b, sub_count))
+    total = sum(i[1] for i in partitions)
+    if total < count:
+        # publication date out of the range, e.g., wrong or future date
+        rest = (f'({query}) NOT ("{FIRST_DAY:%Y/%m/%d}"[PDAT] : '
+                f'"{today:%Y/%m/%d}"[PDAT])')
+        rest_count = int(client.esearch(rest)['Count'])
+        if rest_count != 0:
+            partitions.append([rest, rest_count])
+            total += rest_count
+    if total < count:
+        raise RuntimeError(f'Parts only have {total} of {count} records.')
+    log.info(f'\tGot {len(partitions)} parts.')
+    return partitions
+
+
+def fetch_query(client, checkpoint: dict, checkpoint_file: Path, fetch=None,
+                pipe=None, label='', compress=False):
+    """
+    Fetch records of the query in checkpoint into its file. After each
+    batch, progress is saved in the checkpoint.
+    Args:
+        client(EUtils): client
+        checkpoint(dict): see download
+        checkpoint_file(Path): file to save checkpoint
+        fetch(Callable or None): see EUtils.fetch_batches
+        pipe(Queue or None): see download
+        label(str): prefix of log
+        compress(bool): write BGZF file or not, ignored if resuming
+    Return:
+        file_name(Path or None): None if failed
+    """
+    query_handle = {'WebEnv': checkpoint['WebEnv'],
+                    'QueryKey': checkpoint['QueryKey']}
+    count = checkpoint['Count']
+    ret_max = checkpoint['RetMax']
+    file_name = Path(checkpoint['File'])
+    done = checkpoint['Done']
+    ret_start = done[-1][1] if done else 0
+    # keep the format of downloaded data
+    if checkpoint['Offset'] != 0:
+        compress = is_compressed(file_name)
+    if compress:
+        output = BgzfWriter(file_name, 'ab')
+    else:
+        output = open(file_name, 'ab')
+    with output:
+        # drop incomplete data after the last checkpoint
+        output.truncate(checkpoint['Offset'])
+        try:
+            for start, end, data in client.fetch_batches(
+                    query_handle, count, ret_max, ret_start, fetch=fetch,
+                    adaptive=True):
+                log.info('\t{}{:d}--{:d}'.format(label, start, end))
+                output.write(data)
+                output.flush()
+                if pipe is not None:
+                    pipe.put(data)
+                # batches are in order, merge continuous ranges
+                if done and done[-1][1] == start:
+                    done[-1][1] = end
+                else:
+                    done.append([start, end])
+                checkpoint['Offset'] = output.tell()
+                write_checkpoint(checkpoint, checkpoint_file)
+        except RuntimeError as e:
+            log.critical(f'{label}{e}')
+            return None
+    checkpoint['Finished'] = True
+    write_checkpoint(checkpoint, checkpoint_file)
+    return file_name
+
+
+def download_partition(client, query: str, index: int, arg, fetch=None):
+    """
+    Download one part of the query into its own file in the temporary
+    folder, with its own checkpoint.
+    Return:
+        file_name(Path or None): None if failed
+    """
+    label = f'Part {index+1}: '
+    checkpoint_file = arg._tmp / f'Checkpoint-{index+1}.json'
+    checkpoint = None
+    if arg.resume:
+        checkpoint = read_checkpoint(checkpoint_file, query)
+    if checkpoint is not None and checkpoint['Finished']:
+        log.info(f'\t{label}downloaded. Skip.')
+        return Path(checkpoint['File'])
+    if checkpoint is not None:
+        if not refresh_query(client, checkpoint, label):
+            return None
+    else:
+        try:
+            query_handle = client.esearch(query)
+        except RuntimeError as e:
+            log.critical(f'{label}{e}')
+            return None
+        count = int(query_handle['Count'])
+        kept_file = arg._tmp / f'Prefilter-{index+1}.txt'
+        search_query, accession_file = query, None
+        if arg.prefilter and count != 0:
+            kept_handle, count = prefilter(client, query_handle, count, arg,
+                                           kept_file)
+            if count == -1:
                 return None
-        ret_start += ret_max
-    log.info('Download finished.')
+            if kept_handle is not None and kept_handle != query_handle:
+                search_query, accession_file = None, str(kept_file)
+            query_handle = kept_handle
+        file_name = arg._tmp / f'Part-{index+1}.gb'
+        checkpoint = {'Query': query, 'Search': search_query,
+                      'Accessions': accession_file, 'Total': count,
+                      'WebEnv': '', 'QueryKey': '',
+                      'Count': count, 'RetMax': get_ret_max(max(count, 1)),
+                      'File': str(file_name), 'Done': [], 'Offset': 0,
+                      'Finished': False}
+        if count == 0:
+            file_name.write_bytes(b'')
+            checkpoint['Finished'] = True
+            write_checkpoint(checkpoint, checkpoint_file)
+            return file_name
+        checkpoint['WebEnv'] = query_handle['WebEnv']
+        checkpoint['QueryKey'] = query_handle['QueryKey']
+    return fetch_query(client, checkpoint, checkpoint_file, fetch,
+                       label=label, compress=arg.compress)
+
+
+def merge_partitions(files: list, file_name: Path, pipe=None,
+                     compress=False) -> int:
+    """
+    Merge downloaded parts and remove duplicate records by accession.
+    Args:
+        files(list): genbank files of parts, in order
+        file_name(Path): output
+        pipe(Queue or None): see download
+        compress(bool): write BGZF file or not
+    Return:
+        size(int): size of output
+    """
+    from OGU import entrez
+    seen = set()
+    duplicate = 0
+    buffer = []
+    buffer_size = 0
+    with open_file(file_name, 'wb', compress) as output:
+        for part in files:
+            for record in genbank.read_file(part):
+                match = entrez.VERSION.search(record)
+                accession = match.group(1) if match else record
+                if accession in seen:
+                    duplicate += 1
+                    continue
+                seen.add(accession)
+                output.write(record)
+                if pipe is not None:
+                    buffer.append(record)
+                    buffer_size += len(record)
+                    if buffer_size >= 1024 * 1024:
+                        pipe.put(b''.join(buffer))
+                        buffer.clear()
+                        buffer_size = 0
+        output.flush()
+        size = output.tell()
+    if buffer:
+        pipe.put(b''.join(buffer))
+    if duplicate != 0:
+        log.info(f'\tRemoved {duplicate} duplicate records in parts.')
+    log.info(f'\tMerged {len(seen)} records into {file_name}.')
+    return size
+
+
+def download_partitions(client, checkpoint: dict, checkpoint_file: Path,
+                        arg, pipe=None, fetch=None):
+    """
+    Download parts of the query independently, then merge them. Failure of
+    one part does not affect others, and "-resume" only downloads
+    unfinished parts.
+    Return:
+        file_name(Path or None): None if failed
+    """
+    partitions = checkpoint['Partitions']
+    file_name = Path(checkpoint['File'])
+    log.info(f'\tDownloading {len(partitions)} parts...')
+    log.warning('\tMay be slow if connection is unstable. Ctrl+C to quit.')
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=PARTITION_WORKERS) as pool:
+        futures = [pool.submit(download_partition, client, query, index,
+                               arg, fetch)
+                   for index, (query, _) in enumerate(partitions)]
+        files = []
+        try:
+            for index, i in enumerate(futures):
+                # failure of one part should not stop others
+                try:
+                    files.append(i.result())
+                except Exception as e:
+                    log.critical(f'Part {index+1}: {e}')
+                    files.append(None)
+        except KeyboardInterrupt:
+            for i in futures:
+                i.cancel()
+            log.info('Download was interrupted. Wait for running parts. '
+                     'Use "-resume" to continue.')
+            raise
+    failed = [str(index+1) for index, i in enumerate(files) if i is None]
+    if failed:
+        log.critical(f'Failed to download part {", ".join(failed)}.')
+        log.info('Abort download. Use "-resume" to continue.')
+        return None
+    checkpoint['Offset'] = merge_partitions(files, file_name, pipe,
+                                            arg.compress)
+    checkpoint['Finished'] = True
+    write_checkpoint(checkpoint, checkpoint_file)
+    for i in files:
+        i.unlink()
+    used_time = max(time()-start_time, 1e-3)
+    log.info(f'Download finished. {len(partitions)} parts in '
+             f'{used_time:.1f} seconds.')
+    return file_name
+
+
+def download(arg, pipe=None):
+    """
+    Download records from Genbank.
+    Because of connection to Genbank website is not stable (especially in
+    Asia), it will retry if failed. Ctrl+C to break.
+    Several batches are downloaded at the same time and are written in order.
+    After each batch, progress is saved in Checkpoint.json. If the download
+    failed or was interrupted, use "-resume" to continue.
+    If the query has more records than "-partition_size", it is split by
+    publication date and each part is downloaded independently.
+    If "-cache" is set, only download records that are not in local cache.
+    Args:
+        arg: arguments
+        pipe(Queue or None): if given, put downloaded data into it for
+        dividing at the same time
+    Return:
+        file_name(Path or None): downloaded file
+    """
+    from OGU import entrez
+    too_much = TOO_MUCH
+    # although Bio.Entrez has max_tries, current code could handle error
+    # clearly
+    retry_max = 10
+    if arg.email is None:
+        email = 'guest@example.com'
+        log.info(f'\tEmail address for using Entrez missing, '
+                 f'use {email} instead.')
+    else:
+        email = arg.email
+    client = entrez.EUtils(email, arg.api_key, retry_max)
+    if arg.fetch_mode == 'ft':
+        fetch = client.efetch_ft
+    else:
+        fetch = None
     json_file = arg._tmp / 'Query.json'
-    with open(json_file, 'w', encoding='utf-8') as _:
-        json.dump(query_handle, _, indent=4, sort_keys=True)
-    log.info(f'The query info was dumped into {json_file}')
+    checkpoint_file = arg._tmp / 'Checkpoint.json'
+    checkpoint = None
+    # for "-resume", accession list is identified by its filename
+    if arg.accession_file is None:
+        task = arg.query
+    else:
+        task = f'{arg.accession_file}: {arg.query}'
+    if arg.resume and not arg.cache:
+        checkpoint = read_checkpoint(checkpoint_file, task)
+    if checkpoint is None:
+        try:
+            if arg.accession_file is None:
+                query_handle = client.esearch(arg.query)
+            else:
+                accessions = read_accession_file(arg.accession_file)
+                log.info(f'\tRead {len(accessions)} accessions from '
+                         f'{arg.accession_file}.')
+                if not accessions:
+                    log.info('Abort download.')
+                    return None
+                query_handle = post_accessions(client, accessions,
+                                               arg.query)
+        except (RuntimeError, OSError) as e:
+            log.critical(str(e))
+            log.info('Abort download.')
+            return None
+        count = int(query_handle['Count'])
+        if count == 0:
+            log.warning('Got 0 record. Please check the query.')
+            log.info('Abort download.')
+            return None
+        elif count > too_much and arg.count > too_much:
+            log.warning(f'Got {count} records. '
+                        f'May cost long time to download.')
+        else:
+            log.info(f'\tGot {count} records.')
+        # "-count" only works on one query
+        split = (arg.partition_size > 0 and count > arg.partition_size and
+                 arg.count == 0 and not arg.cache and
+                 arg.accession_file is None)
+        if arg.count != 0:
+            if count > arg.count:
+                count = arg.count
+                log.info(f'\tDownload {arg.count} records due to "-count".')
+        with open(json_file, 'w', encoding='utf-8') as _:
+            json.dump(query_handle, _, indent=4, sort_keys=True)
+        log.info(f'The query info was dumped into {json_file}')
+        file_name = arg._gb / get_gb_name(arg)
+        if split:
+            try:
+                partitions = partition_query(client, arg.query, count,
+                                             arg.partition_size)
+            except RuntimeError as e:
+                log.critical(str(e))
+                log.info('Abort download.')
+                return None
+            checkpoint = {'Query': task, 'Partitions': partitions,
+                          'File': str(file_name), 'Offset': 0,
+                          'Finished': False}
+            write_checkpoint(checkpoint, checkpoint_file)
+            return download_partitions(client, checkpoint, checkpoint_file,
+                                       arg, pipe, fetch)
+        # for searching again on "-resume"
+        kept_file = arg._tmp / 'Prefilter.txt'
+        search_query = arg.query
+        accession_file = arg.accession_file
+        if arg.prefilter:
+            kept_handle, count = prefilter(client, query_handle, count, arg,
+                                           kept_file)
+            if kept_handle is None:
+                log.info('Abort download.')
+                return None
+            if kept_handle != query_handle:
+                search_query, accession_file = None, kept_file
+            query_handle = kept_handle
+        ret_max = get_ret_max(count)
+        if arg.cache:
+            start_time = time()
+            file_name = cached_download(client, query_handle, count,
+                                        file_name, ret_max, pipe, fetch,
+                                        arg.compress, arg.fetch_mode)
+            used_time = max(time()-start_time, 1e-3)
+            if file_name is not None:
+                log.info(f'Download finished. {count} records in '
+                         f'{used_time:.1f} seconds.')
+            return file_name
+        # completed [retstart, retstart+retmax) and size of written data
+        if accession_file is not None:
+            accession_file = str(accession_file)
+        checkpoint = {'Query': task, 'Search': search_query,
+                      'Accessions': accession_file,
+                      'Total': int(query_handle['Count']),
+                      'WebEnv': query_handle['WebEnv'],
+                      'QueryKey': query_handle['QueryKey'], 'Count': count,
+                      'RetMax': ret_max, 'File': str(file_name), 'Done': [],
+                      'Offset': 0, 'Finished': False}
+    else:
+        file_name = Path(checkpoint['File'])
+        if checkpoint['Finished']:
+            log.info(f'\t{file_name} was downloaded. Skip.')
+            # for dividing
+            send_file(file_name, checkpoint['Offset'], pipe)
+            return file_name
+        if 'Partitions' in checkpoint:
+            return download_partitions(client, checkpoint, checkpoint_file,
+                                       arg, pipe, fetch)
+        if not refresh_query(client, checkpoint):
+            log.info('Abort download.')
+            return None
+        log.info(f'\tResume download from {checkpoint["Offset"]} bytes of '
+                 f'{file_name}.')
+        send_file(file_name, checkpoint['Offset'], pipe)
+    log.info('\tDownloading...')
+    log.warning('\tMay be slow if connection is unstable. Ctrl+C to quit.')
+    done = checkpoint['Done']
+    ret_start = done[-1][1] if done else 0
+    start_time = time()
+    try:
+        file_name = fetch_query(client, checkpoint, checkpoint_file, fetch,
+                                pipe, compress=arg.compress)
+    except KeyboardInterrupt:
+        log.info('Download was interrupted. Use "-resume" to continue.')
+        raise
+    if file_name is None:
+        log.info('Abort download. Use "-resume" to continue.')
+        return None
+    used_time = max(time()-start_time, 1e-3)
+    fetched = checkpoint['Count'] - ret_start
+    log.info(f'Download finished. {fetched} records in {used_time:.1f} '
+             f'seconds ({fetched/used_time:.1f} records/s).')
     return file_name
 
 
-def clean_gb(gbfile):
+def clean_gb(gbfile, handle=None, duplicates=None):
     """
     Records in Genbank may be problematic. Check it before parse and skip
     abnormal records.
+    Fields that divide needs are read by genbank.scan_record, which is much
+    faster than SeqIO. Only use SeqIO for records it could not handle.
+    Args:
+        gbfile(Path): genbank file
+        handle(Iterable or None): raw data (bytes) of genbank records, if
+        given, read it instead of gbfile
+        duplicates(genbank.DuplicateFilter or None): skip duplicate records
+        of all input files
     """
     log.info('\tCheck Genbank file to remove abnormal records.')
-
-    def parse_gb(handle):
-        record = []
-        for line in handle:
-            record.append(line)
-            if line.startswith('//'):
-                yield record
-                record = []
-            else:
-                pass
-
     wrong = 0
-    old_gb = open(gbfile, 'r')
-    tmp_gb = StringIO()
-    for record in parse_gb(old_gb):
+    duplicated = 0
+    if handle is None:
+        records = genbank.read_file(gbfile)
+    else:
+        records = genbank.read_records(handle)
+    for record in records:
+        if duplicates is not None and duplicates.check(record) is not None:
+            duplicated += 1
+            continue
+        gb_record = genbank.scan_record(record)
+        if gb_record is not None:
+            yield gb_record
+            continue
         # StringIO is faster than write tmp file to disk and read
-        tmp_gb = StringIO()
-        for _ in record:
-            tmp_gb.write(_)
-        tmp_gb.seek(0)
+        tmp_gb = StringIO(record.decode('utf-8', errors='replace'))
         try:
             gb_record = SeqIO.read(tmp_gb, 'gb')
             yield gb_record
         except Exception as e:
             log.critical('\tFound problematic record {}: {}'.format(
-                record[0][:25], e.args[0]))
+                record[:25].decode('utf-8', errors='replace'), e.args[0]))
             wrong += 1
-    tmp_gb.close()
-    old_gb.close()
+        tmp_gb.close()
     if wrong != 0:
         log.info('\tRemove {} abnormal records.'.format(wrong))
+    if duplicated != 0:
+        log.info(f'\tRemove {duplicated} duplicate records.')
 
 
 def get_feature_name(feature, arg):
@@ -374,102 +1326,78 @@ def get_feature_name(feature, arg):
     return name
 
 
-def get_spacer(genes):
+def get_spacer(genes, allow_mosaic=True, allow_invert_repeat=True):
     """
     Given list of genes, extract spacers.
-    genes: [name, feature]
+    Args:
+        genes(list): [name, type, parts, operator]
+        allow_mosaic(bool): keep mosaic spacers or not
+        allow_invert_repeat(bool): keep spacers of invert repeat or not
+    Return:
+        spacers(list): [name, type, parts, operator]
     """
     if len(genes) <= 1:
         return []
     spacers = list()
     names = set()
+    # (start, end) of the whole gene
+    bounds = [(min(i[0] for i in parts), max(i[1] for i in parts))
+              for _, _, parts, _ in genes]
     # sorted according to sequence starting position
-    genes.sort(key=lambda x: int(x[1].location.start))
+    order = sorted(range(len(genes)), key=lambda x: bounds[x][0])
+    genes[:] = [genes[i] for i in order]
+    bounds = [bounds[i] for i in order]
     for i in range(len(genes)-1):
-        b_name, before = genes[i]
-        c_name, current = genes[i+1]
-        invert_repeat = False
-        repeat = False
+        b_name = genes[i][0]
+        c_name = genes[i+1][0]
+        b_start, b_end = bounds[i]
+        c_start, c_end = bounds[i+1]
         # gene name may contain "_", use "-" instead
-        # sorted_name = '-'.join(sorted([b_name, c_name]))
-        # to be continued
         name = '-'.join([b_name, c_name])
         # 1. A.start--A.end--B.start--B.end
-        if before.location.end <= current.location.start:
+        if b_end <= c_start:
             # check invert repeat
             invert_name = '-'.join([c_name, b_name])
             if invert_name in names:
-                invert_repeat = True
-            elif name in names:
-                repeat = True
-            else:
+                if not allow_invert_repeat:
+                    continue
+            elif name not in names:
                 names.add(name)
-            spacer = SeqFeature(
-                type='spacer',
-                id=name,
-                location=FeatureLocation(before.location.end,
-                                         current.location.start),
-                qualifiers={'upstream': b_name,
-                            'downstream': c_name,
-                            'repeat': str(repeat),
-                            'invert_repeat': str(invert_repeat)})
-            spacers.append(spacer)
+            spacers.append([name, 'spacer', [(b_end, c_start, None)], ''])
         # 2. A.start--B.start--A.end--B.end
-        elif before.location.end <= current.location.end:
+        elif b_end <= c_end:
             # overlap, no spacer
             pass
         # 3. A.start--B.start--B.end--A.end
-        else:
-            spacer_up = SeqFeature(
-                type='mosaic_spacer',
-                id=name,
-                location=FeatureLocation(before.location.start,
-                                         current.location.start),
-                qualifiers={'upstream': b_name,
-                            'downstream': c_name,
-                            'repeat': str(repeat),
-                            'invert_repeat': str(invert_repeat)})
-            spacer_down = SeqFeature(
-                type='mosaic_spacer',
-                id='-'.join([c_name, b_name]),
-                location=FeatureLocation(current.location.end,
-                                         before.location.end),
-                qualifiers={'upstream': b_name,
-                            'downstream': c_name,
-                            'repeat': str(repeat),
-                            'invert_repeat': str(invert_repeat)})
-            spacers.extend([spacer_up, spacer_down])
-    spacers = [i for i in spacers if len(i) != 0]
+        elif allow_mosaic:
+            spacers.append([name, 'mosaic_spacer',
+                            [(b_start, c_start, None)], ''])
+            spacers.append(['-'.join([c_name, b_name]), 'mosaic_spacer',
+                            [(c_end, b_end, None)], ''])
+    spacers = [i for i in spacers if i[2][0][1] != i[2][0][0]]
     return spacers
 
 
 def get_intron(genes):
     """
     Given list of genes, extract introns.
-    genes: [name, feature]
+    Args:
+        genes(Iterable): [name, parts]
     Return:
-        intron(list): [name, feature]
+        intron(list): [name, type, parts, operator]
     """
-    # exons = []
     introns = []
-    for gene_name, feature in genes:
-        # for n, part in enumerate(feature.location.parts):
-        #     exon = SeqFeature(
-        #     type='exon',
-        #     id='-'.join([gene_name, n+1]),
-        #     location=part,
-        #     qualifiers={'gene': gene_name,
-        #                 'count': n+1})
-        # exons.append(exon)
-        strand = feature.location.strand
+    for gene_name, parts in genes:
+        strands = {i[2] for i in parts}
+        strand = parts[0][2] if len(strands) == 1 else None
         # sort by start, no matter which strand
-        parts = sorted(feature.location.parts, key=lambda x: x.start)
+        parts = sorted(parts, key=lambda x: x[0])
         n_part = len(parts)
         for i in range(len(parts)-1):
             before = parts[i]
             current = parts[i+1]
             # Z00028
-            if before.end >= current.start:
+            if before[1] >= current[0]:
                 break
             # complement strand use reversed index
             # n_intron start with 1 instead of 0
@@ -477,21 +1405,19 @@ def get_intron(genes):
                 n_intron = i + 1
             else:
                 n_intron = n_part - i - 1
-            intron = SeqFeature(
-                type='intron',
-                id='{}.{}'.format(gene_name, n_intron),
-                location=FeatureLocation(before.end,
-                                         current.start,
-                                         before.strand),
-                qualifiers={'gene': gene_name,
-                            'count': n_intron})
-            introns.append(intron)
+            introns.append(['{}.{}'.format(gene_name, n_intron), 'intron',
+                            [(before[1], current[0], before[2])], ''])
     return introns
 
 
-def divide(gbfile, arg):
+def divide(gbfile, arg, records=None):
     """
     Given genbank file, return divided fasta files.
+    Args:
+        gbfile(Path): genbank file
+        arg: arguments
+        records(Iterable or None): if given, divide it instead of reading
+        gbfile
     """
     log.info('Divide {} by annotation.'.format(gbfile))
 
@@ -506,17 +1432,18 @@ def divide(gbfile, arg):
         my_class = ''
         my_order = ''
         my_family = ''
+        lineage = taxonomy.get_lineage()
         for item in taxon_str:
-            if item in SUPERKINGDOMS:
+            if item in lineage['superkingdoms']:
                 my_kingdom = item
             # mix superkingdom and kingdom to reduce name length
-            elif item in KINGDOMS:
+            elif item in lineage['kingdoms']:
                 my_kingdom = item
-            elif item in PHYLA:
+            elif item in lineage['phyla']:
                 my_phylum = item
-            elif item in CLASSES:
+            elif item in lineage['classes']:
                 my_class = item
-            if item.endswith('ales') or item in ANIMAL_ORDERS:
+            if item.endswith('ales') or item in lineage['animal_orders']:
                 my_order = item
             elif item.endswith('aceae') or item.endswith('idae'):
                 my_family = item
@@ -532,126 +1459,274 @@ def divide(gbfile, arg):
                 my_class = ''
         return my_kingdom, my_phylum, my_class, my_order, my_family
 
+    # ranks of records with taxon id are read from taxonomy index
+    taxonomy_index = taxonomy.load_index()
+    taxon_cache = {}
     raw_fasta = arg._fasta / (gbfile.stem+'.fasta')
-    handle_raw = open(raw_fasta, 'w', encoding='utf-8')
-    for record in clean_gb(gbfile):
-        # only accept gene, product, and spacer in misc_features.note
-        taxon_str = record.annotations.get('taxonomy', None)
-        if taxon_str is None:
-            kingdom, phylum, class_, order, family = '', '', '', '', ''
-        else:
-            kingdom, phylum, class_, order, family = get_taxon(taxon_str)
-        # gb annotation may be empty
-        organism = record.annotations.get('organism', None)
-        if organism is not None:
-            organism = organism.replace(' ', '_')
-            genus, *species = organism.split('_')
-        else:
-            genus, species = '', ''
-        # species name may contain other characters
-        taxon = '{}|{}|{}|{}|{}|{}|{}'.format(kingdom, phylum, class_,
-                                              order, family, genus,
-                                              '_'.join(species))
-        accession = record.annotations.get('accessions', ['', ])[0]
-        specimen = record.features[0].qualifiers.get('specimen_voucher',
-                                                     ['', ])
-        specimen = specimen[0].replace(' ', '_')
-        isolate = record.features[0].qualifiers.get('isolate', ['', ])
-        isolate = isolate[0].replace(' ', '_')
-        # usually the record only has one of them
-        specimen = '_'.join([specimen, isolate]).rstrip('_')
-        seq_info = (taxon, accession, specimen)
-        whole_seq = record.seq
-        feature_name = []
-        have_intron = {}
-        genes = []
-        not_genes = []
-        # get genes
-        for feature in record.features:
-            # skip unsupport feature
-            # support: gene, CDS, tRNA, rRNA, misc_feature, misc_RNA
-            name = get_feature_name(feature, arg)
-            if name is None:
+    if records is None:
+        records = clean_gb(gbfile, duplicates=arg._duplicates)
+    # avoid opening files for each record
+    with FastaWriter(compress=arg.compress) as writer, open_file(
+            raw_fasta, 'w', arg.compress) as handle_raw:
+        for record in records:
+            # only accept gene, product, and spacer in misc_features.note
+            taxon_str = record.annotations.get('taxonomy', None)
+            ranks = None
+            if taxonomy_index is not None:
+                taxon_id = taxonomy.get_taxon_id(record.features[0].qualifiers)
+                if taxon_id is not None:
+                    ranks = taxonomy_index.get_ranks(taxon_id)
+            if ranks is not None:
+                kingdom, phylum, class_, order, family = ranks
+            elif taxon_str is None:
+                kingdom, phylum, class_, order, family = '', '', '', '', ''
+            else:
+                # records of the same species share the lineage
+                key = tuple(taxon_str)
+                if key not in taxon_cache:
+                    taxon_cache[key] = get_taxon(taxon_str)
+                kingdom, phylum, class_, order, family = taxon_cache[key]
+            # gb annotation may be empty
+            organism = record.annotations.get('organism', None)
+            if organism is not None:
+                organism = organism.replace(' ', '_')
+                genus, *species = organism.split('_')
+            else:
+                genus, species = '', ''
+            # species name may contain other characters
+            taxon = '{}|{}|{}|{}|{}|{}|{}'.format(kingdom, phylum, class_,
+                                                  order, family, genus,
+                                                  '_'.join(species))
+            accession = record.annotations.get('accessions', ['', ])[0]
+            specimen = record.features[0].qualifiers.get('specimen_voucher',
+                                                         ['', ])
+            specimen = specimen[0].replace(' ', '_')
+            isolate = record.features[0].qualifiers.get('isolate', ['', ])
+            isolate = isolate[0].replace(' ', '_')
+            # usually the record only has one of them
+            specimen = '_'.join([specimen, isolate]).rstrip('_')
+            seq_info = (taxon, accession, specimen)
+            try:
+                whole_seq = genbank.get_data(record.seq)
+            except ValueError:
+                # undefined sequence of CONTIG records
+                log.warning(f'Invalid sequence {accession}.')
                 continue
-            if len(name) > arg.max_name_len:
-                log.debug(f'Too long name: {name}. Truncated.')
-                name = name[:arg.max_name_len-3] + '...'
-            if feature.type == 'gene':
-                genes.append([name, feature])
-                # only use gene name as sequence id
-                feature_name.append(name)
+            feature_name = []
+            have_intron = {}
+            genes = []
+            not_genes = []
+            # get genes
+            for feature in record.features:
+                # skip unsupport feature
+                # support: gene, CDS, tRNA, rRNA, misc_feature, misc_RNA
+                name = get_feature_name(feature, arg)
+                if name is None:
+                    continue
+                if len(name) > arg.max_name_len:
+                    log.debug(f'Too long name: {name}. Truncated.')
+                    name = name[:arg.max_name_len-3] + '...'
+                item = [name, feature.type,
+                        genbank.get_parts(feature.location),
+                        feature.location_operator]
+                if feature.type == 'gene':
+                    genes.append(item)
+                    # only use gene name as sequence id
+                    feature_name.append(name)
+                else:
+                    not_genes.append(item)
+                if item[3] == 'join':
+                    # use dict to remove repeat name of gene/CDS/tRNA/rRNA
+                    have_intron[name] = item
+
+            # write genes
+            write_seq(genes, seq_info, whole_seq, arg, writer)
+            # write non-genes
+            write_seq(not_genes, seq_info, whole_seq, arg, writer)
+            # skip fragments that "-keep_features" excludes
+            keep_types = arg._keep_types or FRAGMENT_TYPES
+            if keep_types & {'spacer', 'mosaic_spacer'}:
+                # extract spacer
+                spacers = get_spacer(genes, arg.allow_mosaic_spacer,
+                                     arg.allow_invert_repeat)
+                write_seq(spacers, seq_info, whole_seq, arg, writer)
+            if 'intron' in keep_types:
+                # extract intron
+                introns = get_intron([(i[0], i[2]) for i in
+                                      have_intron.values()])
+                write_seq(introns, seq_info, whole_seq, arg, writer)
+            # write to group_by name, i.e., one gb record one fasta
+            if 'ITS' in feature_name:
+                name_str = 'ITS'
+            elif len(feature_name) >= 4:
+                name_str = '{}-...-{}'.format(feature_name[0],
+                                              feature_name[-1])
+            elif len(feature_name) == 0:
+                name_str = 'Unknown'
             else:
-                not_genes.append([name, feature])
-            if feature.location_operator == 'join':
-                # use dict to remove repeat name of gene/CDS/tRNA/rRNA
-                have_intron[name] = feature
-
-        # write genes
-        write_seq(genes, seq_info, whole_seq, arg)
-        # write non-genes
-        write_seq(not_genes, seq_info, whole_seq, arg)
-        # extract spacer
-        spacers = get_spacer(genes)
-        # write spacer annotations
-        if not arg.allow_mosaic_spacer:
-            spacers = [i for i in spacers if i.type != 'mosaic_spacer']
-        # record.features.extend(spacers)
-        # extract intron
-        introns = get_intron(have_intron.items())
-        # record.features.extend(introns)
-        if not arg.allow_invert_repeat:
-            spacers = [i for i in spacers if i.qualifiers[
-                'invert_repeat'] == 'False']
-        # write seq
-        spacers_to_write = [[i.id, i] for i in spacers]
-        # write intron or not?
-        introns_to_write = [(i.id, i) for i in introns]
-        write_seq(spacers_to_write, seq_info, whole_seq, arg)
-        write_seq(introns_to_write, seq_info, whole_seq, arg)
-        # write to group_by name, i.e., one gb record one fasta
-        if 'ITS' in feature_name:
-            name_str = 'ITS'
-        elif len(feature_name) >= 4:
-            name_str = '{}-...-{}'.format(feature_name[0], feature_name[-1])
-        elif len(feature_name) == 0:
-            name_str = 'Unknown'
-        else:
-            name_str = '-'.join(feature_name)
-        # directly use genome type as name
-        if arg.organelle not in ('ignore', 'no', 'both'):
-            name_str = '{}_genome'.format(arg.organelle)
-        record.id = '|'.join([name_str, taxon, accession, specimen])
-        record.description = ''
-        filename = arg._fasta / (name_str+'.fasta')
-        try:
-            with open(filename, 'a', encoding='utf-8') as out:
-                SeqIO.write(record, out, 'fasta')
+                name_str = '-'.join(feature_name)
+            # directly use genome type as name
+            if arg.organelle not in ('ignore', 'no', 'both'):
+                name_str = '{}_genome'.format(arg.organelle)
+            # records are written once, group_fasta could split them by
+            # name_str
+            record.id = '|'.join([name_str, taxon, accession, specimen])
             # write raw fasta
-            SeqIO.write(record, handle_raw, 'fasta')
-        except Exception:
-            log.warning(f'Invalid sequence {accession}.')
+            try:
+                genbank.write_fasta(handle_raw, record.id, whole_seq)
+            except Exception:
+                log.warning(f'Invalid sequence {accession}.')
+                continue
     # skip analyze of Unknown.fasta
     # unknown = arg._divide / 'Unknown.fasta'
     log.info('Divide finished.')
     return arg._fasta, arg._divide
 
 
-def write_seq(record, seq_info, whole_seq, arg):
+def divide_shard(gbfile: Path, start: int, end: int, arg, n: int,
+                 skip=None) -> Path:
+    """
+    Divide records in byte range [start, end) of gbfile.
+    Output files are written into a separate folder to avoid conflict with
+    other processes.
+    Args:
+        gbfile(Path): genbank file
+        start(int): start of range
+        end(int): end of range
+        arg: arguments
+        n(int): index of shard
+        skip(set or None): index of duplicate records in the range
+    Return:
+        shard(Path): folder contains "Fasta", "Divide" and "Expanded_fasta"
+    """
+    shard = arg._tmp / f'Shard-{n}'
+    shard_arg = copy(arg)
+    shard_arg._fasta = shard / arg._fasta.name
+    shard_arg._divide = shard / arg._divide.name
+    shard_arg._expand = shard / arg._expand.name
+    for folder in (shard_arg._fasta, shard_arg._divide, shard_arg._expand):
+        folder.mkdir(parents=True, exist_ok=True)
+    raw_records = genbank.read_range(gbfile, start, end)
+    if skip:
+        raw_records = (record for index, record in enumerate(raw_records)
+                       if index not in skip)
+    records = clean_gb(gbfile, raw_records)
+    divide(gbfile, shard_arg, records)
+    return shard
+
+
+def merge_shards(shards: list, arg) -> None:
+    """
+    Append output of shards to output folders in order, the result is same
+    as dividing records one by one.
+    Args:
+        shards(list): folders returned by divide_shard, in order of records
+        arg: arguments
+    """
+    for shard in shards:
+        for folder in (arg._fasta, arg._divide, arg._expand):
+            for i in sorted((shard/folder.name).iterdir()):
+                with open(i, 'rb') as source, open(folder/i.name,
+                                                   'ab') as dest:
+                    shutil.copyfileobj(source, dest)
+        shutil.rmtree(shard)
+    return
+
+
+def parallel_divide(gbfile: Path, arg):
+    """
+    Divide genbank file with several processes.
+    The file is split into byte ranges on record boundaries, each range is
+    divided into its own folder, then the files are merged in order.
+    Args:
+        gbfile(Path): genbank file
+        arg: arguments
+    """
+    if arg.select is not None:
+        # usually a few records, read them by index
+        log.info(f'Divide {len(arg._selected)} selected records of '
+                 f'{gbfile}.')
+        records = clean_gb(gbfile, genbank.read_selected(
+            gbfile, arg._selected, arg._selected_found), arg._duplicates)
+        return divide(gbfile, arg, records)
+    # more ranges than processes for balance
+    ranges = genbank.split_file(gbfile, arg.threads*4)
+    if arg.threads == 1 or len(ranges) <= 1:
+        return divide(gbfile, arg)
+    log.info(f'Divide {gbfile} with {arg.threads} processes '
+             f'({len(ranges)} parts).')
+    # duplicates are found in order before dividing, much faster than divide
+    skips = []
+    duplicated = 0
+    for start, end in ranges:
+        skips.append({index for index, record in enumerate(
+            genbank.read_range(gbfile, start, end))
+            if arg._duplicates.check(record) is not None})
+        duplicated += len(skips[-1])
+    if duplicated != 0:
+        log.info(f'\tRemove {duplicated} duplicate records.')
+    # shards do not need the filter
+    shard_arg = copy(arg)
+    shard_arg._duplicates = None
+    with ProcessPoolExecutor(arg.threads) as pool:
+        futures = [pool.submit(divide_shard, gbfile, start, end, shard_arg,
+                               n, skips[n])
+                   for n, (start, end) in enumerate(ranges)]
+        shards = [i.result() for i in futures]
+    # divide overwrites the raw fasta of the genbank file
+    with open_file(arg._fasta/(gbfile.stem+'.fasta'), 'w', arg.compress):
+        pass
+    merge_shards(shards, arg)
+    log.info('Divide finished.')
+    return arg._fasta, arg._divide
+
+
+def group_fasta(files: list, arg) -> set:
+    """
+    Split whole records in raw fasta files written by divide into files of
+    gene names (the first field of sequence id), e.g., "rbcL-...-atpB.fasta".
+    Args:
+        files(list): raw fasta files, in order of records
+        arg: arguments
+    Return:
+        filenames(set): fasta files of groups
+    """
+    log.info('Group records by gene names.')
+    files = list(dict.fromkeys(files))
+    filenames = set()
+    with FastaWriter(compress=arg.compress) as writer:
+        for fasta in files:
+            with open_file(fasta, 'rb') as raw:
+                for start, end, record_id, _ in scan_fasta(fasta):
+                    filename = arg._fasta / (record_id.split('|')[0]+'.fasta')
+                    if filename in files:
+                        log.warning(f'Skip {record_id}, {filename} is the '
+                                    f'raw fasta file of input.')
+                        continue
+                    raw.seek(start)
+                    writer.write(filename, raw.read(end-start).decode(
+                        'utf-8', errors='replace'))
+                    filenames.add(filename)
+    return filenames
+
+
+def write_seq(record, seq_info, whole_seq, arg, writer):
     """
     Write fasta files to "by-gene" folder only.
     ID format: >name|taxon|accession|specimen|type
     Args:
-        record: [name, feature]
+        record: [name, type, parts, operator], parts of expanded "join"
+        features are replaced
         seq_info: (taxon, accession, specimen)
-        whole_seq: whole sequence
+        whole_seq: whole sequence returned by genbank.get_data
         arg: arguments
+        writer(FastaWriter): shared writer, closed by the caller
     Return: {filename}
     """
-    def careful_extract(name, feature, whole_seq):
+    def careful_extract(name, parts):
         # illegal annotation may cause extraction failed
         try:
-            sequence = feature.extract(whole_seq)
-            sequence_str = str(sequence)
+            sequence_str = genbank.extract(whole_seq, parts)
         except Exception as e:
             sequence_str = ''
             log.warning('Cannot extract sequence of {} from {} '
@@ -672,71 +1747,213 @@ def write_seq(record, seq_info, whole_seq, arg):
         record_unique = record
 
     for i in record_unique:
-        name, feature = i
+        name, feature_type, parts, operator = i
         # skip abnormal annotation
-        if len(feature) > arg.max_gene_len:
+        if sum(part[1]-part[0] for part in parts) > arg.max_gene_len:
             log.debug('The fragment of {} (Accession {}) '
                       'is too long. Skip.'.format(name, seq_info[1]))
             continue
-        filename = arg._divide / (feature.type+'-'+name+'.fasta')
-        with open(filename, 'a', encoding='utf-8') as handle:
-            sequence_id = '>' + '|'.join([name, *seq_info, feature.type])
-            sequence = careful_extract(name, feature, whole_seq)
-            handle.write(sequence_id+'\n')
-            handle.write(sequence+'\n')
-        filenames.add(filename)
+        # expanded location of excluded genes is still used by spacers
+        keep = is_kept(name, feature_type, arg)
+        if keep:
+            filename = arg._divide / (feature_type+'-'+name+'.fasta')
+            sequence_id = '>' + '|'.join([name, *seq_info, feature_type])
+            sequence = careful_extract(name, parts)
+            writer.write(filename, sequence_id+'\n'+sequence+'\n')
+            filenames.add(filename)
         if arg.expand != 0:
-            if feature.location_operator == 'join':
-                loc = feature.location.parts
+            if operator == 'join':
                 # ensure increasing order
-                # parts do not have sort method
-                loc.sort(key=lambda x: x.start)
-                new_loc = sum([
-                    # avoid IndexError
-                    FeatureLocation(max(0, loc[0].start-arg.expand),
-                                    loc[0].end, loc[0].strand),
-                    *loc[1:-1],
-                    FeatureLocation(loc[-1].start,
-                                    min(seq_len, loc[-1].end+arg.expand),
-                                    loc[-1].strand)])
-                feature.location = new_loc
-            sequence = careful_extract(name, feature, whole_seq)
-            filename2 = arg._expand / (feature.type+'-'+name+'.fasta')
-            with open(filename2, 'a', encoding='utf-8') as handle:
-                handle.write(sequence_id + '\n')
-                handle.write(str(sequence) + '\n')
+                loc = sorted(parts, key=lambda x: x[0])
+                # avoid IndexError
+                i[2] = [(max(0, loc[0][0]-arg.expand), loc[0][1], loc[0][2]),
+                        *loc[1:-1],
+                        (loc[-1][0], min(seq_len, loc[-1][1]+arg.expand),
+                         loc[-1][2])]
+                if keep:
+                    sequence = careful_extract(name, i[2])
+            if not keep:
+                continue
+            filename2 = arg._expand / (feature_type+'-'+name+'.fasta')
+            writer.write(filename2, sequence_id+'\n'+sequence+'\n')
             expand_files.add(filename2)
-    # keep = ('gene.fasta', 'misc_feature', 'misc_RNA', 'spacer')
-    # for i in filenames:
-        # if i.endswith(keep):
-            # file_to_analyze.append(i)
-        # else:
-            # log.debug('Skip {}'.format(i))
     return filenames
 
 
-def count_for_unique(fasta: Path):
-    info = defaultdict(lambda: list())
-    index = 0
+def scan_fasta(fasta: Path):
+    """
+    Scan raw fasta file once without creating SeqRecord.
+    Same as SeqIO, text before the first ">" is ignored.
+    Args:
+        fasta(Path): fasta file
+    Yield:
+        start(int): offset of ">"
+        end(int): offset after the last line of the record
+        record_id(str): first word of the title
+        length(int): sequence length
+    """
+    start = None
+    record_id = ''
+    length = 0
+    offset = 0
+    with open_file(fasta, 'rb') as raw:
+        for line in raw:
+            if line.startswith(b'>'):
+                if start is not None:
+                    yield start, offset, record_id, length
+                start = offset
+                title = line[1:].decode('utf-8', errors='replace').split(
+                    None, 1)
+                record_id = title[0] if title else ''
+                length = 0
+            elif start is not None:
+                length += len(line.rstrip().replace(b' ', b''))
+            offset += len(line)
+    if start is not None:
+        yield start, offset, record_id, length
+
+
+def get_species(record_id: str) -> str:
+    """
+    Get species of divided sequence id, which is the key of "-unique".
+    """
+    # gene|kingdom|phylum|class|order|family|genus|species|specimen|type
+    if '|' in record_id:
+        return ' '.join(record_id.split('|')[6:8])
+    return record_id
+
+
+def count_for_unique(fasta: Path, method: str):
+    """
+    Find records to keep in one pass.
+    Args:
+        fasta(Path): fasta file
+        method(str): "first" or "longest", otherwise keep nothing
+    Return:
+        keep(list): [start, end] of kept records, in order of the file
+        count(int): number of records
+    """
+    # {name: [start, end, length]}
+    winner = {}
     count = 0
-    for record in SeqIO.parse(fasta, 'fasta'):
-        # gene|kingdom|phylum|class|order|family|genus|species|specimen|type
+    for start, end, record_id, length in scan_fasta(fasta):
         count += 1
-        if '|' in record.id:
-            name = ' '.join(record.id.split('|')[6:8])
-        else:
-            name = record.id
-        length = len(record)
         # skip empty file
-        if length != 0:
-            info[name].append([index, length])
-        index += 1
-    return info, count
+        if length == 0:
+            continue
+        name = get_species(record_id)
+        if name not in winner:
+            winner[name] = [start, end, length]
+        elif method == 'longest' and length > winner[name][2]:
+            # keep the first one if have same length
+            winner[name] = [start, end, length]
+    if method not in ('first', 'longest'):
+        return [], count
+    keep = sorted([i[0], i[1]] for i in winner.values())
+    return keep, count
+
+
+def copy_ranges(source: Path, ranges: list, dest: Path,
+                chunk=1024*1024*16, compress=False) -> Path:
+    """
+    Copy byte ranges of source to dest, continuous ranges are merged to
+    read in large blocks.
+    For compressed source, ranges are positions of decompressed data.
+    Args:
+        source(Path): input file
+        ranges(list): sorted [start, end]
+        dest(Path): output file
+        chunk(int): read size
+        compress(bool): write BGZF file or not
+    Return:
+        dest(Path): output file
+    """
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    with open_file(source, 'rb') as raw, open_file(dest, 'wb',
+                                                   compress) as out:
+        for start, end in merged:
+            raw.seek(start)
+            left = end - start
+            while left > 0:
+                data = raw.read(min(chunk, left))
+                if not data:
+                    break
+                out.write(data)
+                left -= len(data)
+    return dest
+
+
+def read_sequences(fasta: Path) -> (list, list, int):
+    """
+    Read sequences of fasta file with their positions, skip empty records.
+    Return:
+        records(list): [start, end, record_id]
+        sequences(list): [bytes], without line breaks
+        count(int): number of records, including empty records
+    """
+    records = []
+    sequences = []
+    count = 0
+    with open_file(fasta, 'rb') as raw:
+        for start, end, record_id, length in scan_fasta(fasta):
+            count += 1
+            if length == 0:
+                continue
+            raw.seek(start)
+            _, sequence = raw.read(end-start).split(b'\n', 1)
+            records.append([start, end, record_id])
+            sequences.append(sequence.translate(None, b' \r\n'))
+    return records, sequences, count
+
+
+def cluster_for_unique(fasta: Path, arg):
+    """
+    Cluster near-identical sequences of each species and keep one
+    representative of each cluster, so sister species are not merged.
+    Membership is written to a tsv file besides the output.
+    Args:
+        fasta(Path): fasta file
+        arg: arguments
+    Return:
+        keep(list): [start, end] of representatives, in order of the file
+        count(int): number of records
+    """
+    from OGU import cluster
+    records, sequences, count = read_sequences(fasta)
+    # {species: [index]}, same key as "first" and "longest"
+    groups = {}
+    for index, record in enumerate(records):
+        groups.setdefault(get_species(record[2]), []).append(index)
+    representatives = list(range(len(records)))
+    identities = [1.0] * len(records)
+    for indexes in groups.values():
+        if len(indexes) == 1:
+            continue
+        group_reps, group_identities = cluster.cluster(
+            [sequences[i] for i in indexes], arg.identity)
+        for i, rep, value in zip(indexes, group_reps, group_identities):
+            representatives[i] = indexes[rep]
+            identities[i] = value
+    keep = [records[i][:2] for i in sorted(set(representatives))]
+    tsv = arg._unique / (fasta.stem+'.cluster.tsv')
+    with open(tsv, 'w', encoding='utf-8') as out:
+        out.write('Species\tRepresentative\tMember\tIdentity\n')
+        for i, (rep, value) in enumerate(zip(representatives, identities)):
+            out.write(f'{get_species(records[i][2])}\t{records[rep][2]}\t'
+                      f'{records[i][2]}\t{value:.4f}\n')
+    return keep, count
 
 
 def unique(files: list, arg) -> list:
     """
-    Remove redundant sequences of same species.
+    Remove redundant sequences of same species, or near-identical sequences
+    if "-unique cluster".
+    Each file is scanned once, kept records are copied without parsing.
     Files were saved in arg._unique
     """
     log.info('Removing redundant records...')
@@ -746,30 +1963,57 @@ def unique(files: list, arg) -> list:
     total = 0
     kept = 0
     for fasta in files:
-        keep = dict()
-        info, count = count_for_unique(fasta)
-        total += count
-        if arg.unique == 'first':
-            # keep only the first record
-            keep = {info[i][0][0] for i in info}
-        elif arg.unique == 'longest':
-            for i in info:
-                info[i] = sorted(info[i], key=lambda x: x[1], reverse=True)
-            keep = {info[i][0][0] for i in info}
+        if arg.unique == 'cluster':
+            keep, count = cluster_for_unique(fasta, arg)
         else:
-            # ignore "no"
-            pass
+            keep, count = count_for_unique(fasta, arg.unique)
+        total += count
         kept += len(keep)
         new = arg._unique / fasta.name
-        with open(new, 'w', encoding='utf-8') as out:
-            for idx, record in enumerate(SeqIO.parse(fasta, 'fasta')):
-                if idx in keep:
-                    SeqIO.write(record, out, 'fasta')
+        copy_ranges(fasta, keep, new, compress=arg.compress)
         unique_files.append(new)
     log.info(f'{kept} of {total} unique records.')
     return unique_files
 
 
+def screen_files(files: list, arg) -> list:
+    """
+    Remove abnormal sequences before alignment, see screen.screen.
+    Removed sequences and reasons are written to "Screened.tsv" in
+    arg._unique.
+    Args:
+        files(list): fasta files in arg._unique, will be overwritten
+        arg: arguments
+    Return:
+        files(list): screened files
+    """
+    from OGU import screen
+    log.info('Screening abnormal sequences before alignment...')
+    report = arg._unique / 'Screened.tsv'
+    total = 0
+    with open(report, 'w', encoding='utf-8') as out:
+        out.write('File\tID\tReason\tValue\tSequence\n')
+        for fasta in files:
+            records, sequences, _ = read_sequences(fasta)
+            reasons = screen.screen(sequences)
+            keep = []
+            for record, sequence, (reason, value) in zip(records, sequences,
+                                                         reasons):
+                if reason is None:
+                    keep.append(record[:2])
+                    continue
+                out.write(f'{fasta.name}\t{record[2]}\t{reason}\t'
+                          f'{value:.4g}\t{sequence.decode()}\n')
+            if len(keep) == len(records):
+                continue
+            total += len(records) - len(keep)
+            tmp = fasta.with_suffix('.tmp')
+            copy_ranges(fasta, keep, tmp, compress=arg.compress)
+            tmp.replace(fasta)
+    log.info(f'{total} abnormal sequences were removed, see {report}.')
+    return files
+
+
 def gb2fasta_main(arg_str=None):
     """
     Collect genbank files and convert them to fasta files.
@@ -786,18 +2030,74 @@ def gb2fasta_main(arg_str=None):
         log.info('Quit gb2fasta module.')
         return None, other_args
     utils.add_file_log(arg)
+    if arg.dry_run:
+        if arg.query is None:
+            log.warning('Dry run needs query options.')
+        else:
+            dry_run(arg)
+        log.info('GB2fasta module finished.')
+        return arg, other_args
     log.info(f'Input genbank files:\t{arg.gb}')
-    if arg.query is not None:
-        log.info(f'Query: {arg.query}')
-        gb_file = download(arg)
-        if gb_file is not None:
-            arg.gb.append(gb_file)
+    if arg.resume and not arg.no_divide:
+        # the whole command will be run again
+        log.info('Clean divided files of the last run.')
+        for folder in (arg._fasta, arg._divide, arg._expand):
+            utils.clean_tmp(folder)
+    if not arg.no_divide:
+        # keep the order of records as before
+        for i in arg.gb:
+            parallel_divide(i, arg)
+        if arg.select is not None:
+            not_found = [i for i in arg._selected
+                         if i not in arg._selected_found]
+            if not_found:
+                log.warning(f'{len(not_found)} accessions of {arg.select} '
+                            f'were not found in input files: '
+                            f'{", ".join(not_found[:10])}'
+                            f'{", ..." if len(not_found) > 10 else ""}')
+    if arg.query is not None or arg.accession_file is not None:
+        if arg.query is not None:
+            log.info(f'Query: {arg.query}')
+        if arg.accession_file is not None:
+            log.info(f'Accession list: {arg.accession_file}')
+        if arg.no_divide:
+            gb_file = download(arg)
+        elif arg.threads > 1:
+            # one process could not divide as fast as several processes
+            gb_file = download(arg)
+            if gb_file is not None:
+                parallel_divide(gb_file, arg)
+        else:
+            # divide while downloading
+            pipe = Queue(maxsize=16)
+            result = []
+            divider = Thread(target=divide_pipe, daemon=True,
+                             args=(pipe, arg._gb/get_gb_name(arg), arg,
+                                   result))
+            divider.start()
+            try:
+                gb_file = download(arg, pipe)
+            finally:
+                pipe.put(None)
+                divider.join()
+            if result:
+                gb_file = None
+        if gb_file is None:
+            # divided files may have partial records of the download
+            log.critical('Failed to download or divide records. Use '
+                         '"-resume" to continue.')
+            if not arg.no_divide:
+                for folder in (arg._fasta, arg._divide, arg._expand):
+                    utils.clean_tmp(folder)
+            log.info('Quit gb2fasta module.')
+            return None, other_args
+        arg.gb.append(gb_file)
     if arg.no_divide:
         log.info('Download finished. Skip dividing.')
         log.info('GB2fasta module finished.')
         return arg, other_args
-    for i in arg.gb:
-        divide(i, arg)
+    if arg.group_fasta:
+        group_fasta([arg._fasta/(i.stem+'.fasta') for i in arg.gb], arg)
     if arg.unique == 'no':
         log.info('Skip removing redundant sequences.')
         unique_files = arg._divide.glob('*.fasta')
@@ -819,6 +2119,8 @@ def gb2fasta_main(arg_str=None):
                 expanded_files = [i for i in expanded_files
                                   if i.name != 'Unknown.fasta']
                 unique_files = unique(expanded_files, arg)
+    if arg.unique != 'no' and arg.screen:
+        unique_files = screen_files(unique_files, arg)
     # for i in unique_files:
     #     utils.move(i, arg._unique/(i.name), copy=True)
     log.info('GB2fasta module finished.')
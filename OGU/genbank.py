@@ -0,0 +1,942 @@
+#!/usr/bin/python3
+
+import hashlib
+import mmap
+import re
+from functools import partial
+from pathlib import Path
+
+from Bio.Seq import Seq
+from Bio.SeqFeature import CompoundLocation, FeatureLocation, SeqFeature
+from Bio.SeqRecord import SeqRecord
+try:
+    from Bio.Seq import SequenceDataAbstractBaseClass
+except ImportError:
+    # biopython < 1.79
+    SequenceDataAbstractBaseClass = None
+
+from OGU.global_vars import log
+from OGU.output import is_compressed, open_file
+
+# only these features are used by divide
+ACCEPT_TYPE = {'gene', 'CDS', 'tRNA', 'rRNA', 'misc_feature', 'misc_RNA'}
+NAME_KEYS = {'gene', 'product', 'locus_tag', 'note'}
+SOURCE_KEYS = {'specimen_voucher', 'isolate', 'db_xref'}
+HEADER_INDENT = ' ' * 12
+FEATURE_INDENT = ' ' * 21
+# remove line number, space and newline of ORIGIN
+NOT_BASE = b'0123456789 \n\r\t/'
+SIMPLE = re.compile(r'^(<?)(\d+)(?:\.\.(>?)(\d+))?$')
+# feature key starts at 6th column, location at 22th column
+FEATURE_KEY = re.compile(r'^ {5}(\S+) *(\S)', re.MULTILINE)
+# standard line of ORIGIN: position in 9 columns, then 6 blocks of 10 bases,
+# each block starts with a space
+ORIGIN_LINE = 76
+ORIGIN_BASES = 60
+# remove them from ORIGIN lines to get fasta lines
+ORIGIN_NUMBER = b'0123456789 '
+# lines of fasta to write at once
+FASTA_BLOCK = 4096
+# index of records is saved beside genbank file
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = '#OGU index'
+# RefSeq records copied from INSDC records, e.g., "PROVISIONAL REFSEQ: ...
+# The reference sequence is identical to MN123456."
+REFSEQ_SOURCE = re.compile(r'[A-Z]+ REFSEQ:.*?(?:identical to|derived from) '
+                           r'(.+?)\.(?:\s|$)')
+ACCESSION = re.compile(r'\b[A-Z]{1,6}_?\d{5,}(?:\.\d+)?\b')
+NEXT_FIELD = re.compile(rb'\n\S')
+UPPER = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz',
+                        b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+# same as Bio.Seq.reverse_complement for DNA, U is treated as T
+COMPLEMENT = bytes.maketrans(b'ACGTURYKMBVDHNSWacgturykmbvdhnsw',
+                             b'TGCAAYRMKVBHDNSWtgcaayrmkvbhdnsw')
+
+
+def read_records(chunks):
+    """
+    Split raw data into genbank records.
+    Args:
+        chunks(Iterable): bytes, could be split at any position
+    Yield:
+        record(bytes): from "LOCUS" to "//"
+    """
+    rest = b''
+    for data in chunks:
+        if b'\r' in data:
+            data = data.replace(b'\r', b'')
+        rest += data
+        start = 0
+        while True:
+            if rest.startswith(b'//', start):
+                end = start
+            else:
+                end = rest.find(b'\n//', start)
+                if end == -1:
+                    break
+                end += 1
+            line_end = rest.find(b'\n', end)
+            if line_end == -1:
+                break
+            yield rest[start:line_end+1]
+            start = line_end + 1
+        rest = rest[start:]
+    # incomplete data at the end of file is dropped, same as SeqIO
+    return
+
+
+def read_file(gbfile, size=1024*1024*16):
+    """
+    Read genbank file by large chunk, compressed file is supported.
+    """
+    with open_file(gbfile, 'rb') as raw:
+        yield from read_records(iter(partial(raw.read, size), b''))
+
+
+def read_range(gbfile, start: int, end: int, size=1024*1024*16):
+    """
+    Read records in byte range [start, end) of genbank file.
+    The range should be given by split_file.
+    """
+    def read_chunks(raw):
+        left = end - start
+        while left > 0:
+            data = raw.read(min(size, left))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+
+    with open(gbfile, 'rb') as raw:
+        raw.seek(start)
+        yield from read_records(read_chunks(raw))
+
+
+def split_file(gbfile, n: int, min_size=1024*1024) -> list:
+    """
+    Split genbank file into byte ranges on record boundaries.
+    Args:
+        gbfile(Path): genbank file
+        n(int): expected number of ranges
+        min_size(int): minimum size of each range
+    Return:
+        ranges(list): [[start, end], ...] in order of the file
+    """
+    file_size = Path(gbfile).stat().st_size
+    # offsets of compressed file are not on record boundaries
+    if is_compressed(gbfile):
+        return [[0, file_size]]
+    step = max(min_size, file_size//max(1, n)+1)
+    ranges = []
+    start = 0
+    with open(gbfile, 'rb') as raw:
+        while start < file_size:
+            raw.seek(min(start+step, file_size))
+            # skip incomplete line, then move to the end of next record
+            raw.readline()
+            for line in raw:
+                if line.startswith(b'//'):
+                    break
+            end = raw.tell()
+            ranges.append([start, end])
+            start = end
+    return ranges
+
+
+def get_record_id(raw, start=0, end=None) -> str:
+    """
+    Get accession with version of one record, use accession or locus name if
+    not found.
+    Args:
+        raw(bytes or mmap): data
+        start(int): start of record
+        end(int): end of record
+    Return:
+        record_id(str): accession.version
+    """
+    if end is None:
+        end = len(raw)
+    # only search in header
+    header_end = raw.find(b'\nFEATURES', start, end)
+    if header_end == -1:
+        header_end = end
+    for key in (b'\nVERSION', b'\nACCESSION', b'LOCUS'):
+        line_start = raw.find(key, start, header_end)
+        if line_start == -1:
+            continue
+        line_end = raw.find(b'\n', line_start+1, header_end)
+        if line_end == -1:
+            line_end = header_end
+        fields = raw[line_start:line_end].split()
+        if len(fields) > 1:
+            return fields[1].rstrip(b';').decode('utf-8', errors='replace')
+    return ''
+
+
+def get_record_key(raw: bytes):
+    """
+    Get fields for finding duplicate records.
+    Args:
+        raw(bytes): one record
+    Return:
+        record_id(str): accession.version
+        digest(bytes): digest of sequence, empty if no sequence
+        sources(list): accessions of INSDC records that the RefSeq record is
+        copied from
+    """
+    record_id = get_record_id(raw)
+    digest = b''
+    origin = raw.find(b'\nORIGIN')
+    if origin != -1:
+        seq_start = raw.find(b'\n', origin+1)
+        seq_end = raw.rfind(b'\n//')
+        if seq_start != -1 and seq_end > seq_start:
+            digest = hashlib.blake2b(
+                raw[seq_start:seq_end].translate(UPPER, NOT_BASE),
+                digest_size=16).digest()
+    sources = []
+    comment = raw.find(b'\nCOMMENT', 0, origin if origin != -1 else len(raw))
+    if comment != -1:
+        match = NEXT_FIELD.search(raw, comment+1)
+        end = match.start() if match is not None else len(raw)
+        text = ' '.join(raw[comment+8:end].decode(
+            'utf-8', errors='replace').split())
+        match = REFSEQ_SOURCE.search(text)
+        if match is not None:
+            sources = ACCESSION.findall(match.group(1))
+    return record_id, digest, sources
+
+
+class DuplicateFilter:
+    """
+    Find duplicate records of all input files, including records of the same
+    accession and sequence, and RefSeq records that are copies of INSDC
+    records ("PROVISIONAL REFSEQ" or "REVIEWED REFSEQ" in COMMENT) with the
+    same sequence. The first one is kept. The version is ignored because
+    the sequence digest is compared.
+    """
+    def __init__(self):
+        # {(accession, digest): record_id}
+        self.seen = {}
+
+    def check(self, raw: bytes):
+        """
+        Check the record and remember it if it is new.
+        Args:
+            raw(bytes): one record
+        Return:
+            first(str or None): id of the kept record if raw is a duplicate
+        """
+        record_id, digest, sources = get_record_key(raw)
+        if not record_id:
+            return None
+        keys = [(i.split('.')[0], digest) for i in (record_id, *sources)]
+        for key in keys:
+            first = self.seen.get(key, None)
+            if first is not None:
+                log.info(f'\tSkip {record_id}, same as {first}.')
+                return first
+        for key in keys:
+            self.seen[key] = record_id
+        return None
+
+
+def get_index_file(gbfile) -> Path:
+    return Path(gbfile).with_name(Path(gbfile).name+INDEX_SUFFIX)
+
+
+def build_index(gbfile):
+    """
+    Find byte range of each record by scanning "//" lines with mmap, save the
+    index beside the genbank file.
+    Format: header with size and modified time of genbank file, then
+    "accession.version offset length" per line.
+    Args:
+        gbfile(Path): uncompressed genbank file
+    Return:
+        index(dict): {accession.version: (offset, length)}, the first one is
+        kept if the accession is duplicated
+    """
+    index = {}
+    stat = Path(gbfile).stat()
+    if stat.st_size != 0:
+        with open(gbfile, 'rb') as raw, mmap.mmap(
+                raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while True:
+                if data[start:start+2] == b'//':
+                    end = start
+                else:
+                    end = data.find(b'\n//', start)
+                    if end == -1:
+                        break
+                    end += 1
+                line_end = data.find(b'\n', end)
+                # incomplete record at the end of file is dropped
+                if line_end == -1:
+                    break
+                record_id = get_record_id(data, start, end)
+                if record_id in index:
+                    log.debug(f'Duplicate record {record_id} in {gbfile}.')
+                else:
+                    index[record_id] = (start, line_end+1-start)
+                start = line_end + 1
+    lines = [f'{INDEX_HEADER}\t{stat.st_size}\t{stat.st_mtime_ns}\n']
+    lines.extend(f'{key}\t{offset}\t{length}\n' for key, (offset, length)
+                 in index.items())
+    try:
+        with open(get_index_file(gbfile), 'w', encoding='utf-8') as out:
+            out.write(''.join(lines))
+    except OSError as e:
+        log.debug(f'Cannot write index of {gbfile}: {e}')
+    return index
+
+
+def load_index(gbfile):
+    """
+    Load index written by build_index.
+    Return:
+        index(dict or None): None if not found or the genbank file changed
+    """
+    index_file = get_index_file(gbfile)
+    if not index_file.exists():
+        return None
+    stat = Path(gbfile).stat()
+    index = {}
+    with open(index_file, 'r', encoding='utf-8') as _:
+        header = _.readline().rstrip('\n').split('\t')
+        if header != [INDEX_HEADER, str(stat.st_size), str(stat.st_mtime_ns)]:
+            log.debug(f'Outdated index {index_file}.')
+            return None
+        for line in _:
+            key, offset, length = line.rstrip('\n').split('\t')
+            index[key] = (int(offset), int(length))
+    return index
+
+
+def get_index(gbfile):
+    """
+    Load index of genbank file, build it if not available.
+    Return:
+        index(dict or None): None for compressed file
+    """
+    if is_compressed(gbfile):
+        return None
+    index = load_index(gbfile)
+    if index is None:
+        log.info(f'\tIndex {gbfile}.')
+        index = build_index(gbfile)
+    return index
+
+
+def read_selected(gbfile, accessions: list, found=None):
+    """
+    Read records of given accessions. Use the index to read the records
+    directly, or scan the whole file if the index is not available.
+    Args:
+        gbfile(Path): genbank file
+        accessions(list): accessions with or without version
+        found(set or None): if given, add given accessions that match any
+        record into it
+    Yield:
+        record(bytes): in order of the file
+    """
+    wanted = set(accessions)
+    if found is None:
+        found = set()
+
+    def match(record_id: str) -> bool:
+        keys = {record_id, record_id.split('.')[0]} & wanted
+        found.update(keys)
+        return bool(keys)
+
+    index = get_index(gbfile)
+    if index is None:
+        for record in read_file(gbfile):
+            if match(get_record_id(record)):
+                yield record
+        return
+    ranges = [value for key, value in index.items() if match(key)]
+    ranges.sort()
+    with open(gbfile, 'rb') as raw:
+        for offset, length in ranges:
+            raw.seek(offset)
+            yield raw.read(length)
+
+
+def parse_location(location: str):
+    """
+    Parse location string of simple formats, including "1..10", "<1..>10",
+    "5", "complement(1..10)", "join(1..10,20..30)", "order(...)",
+    "complement(join(...))" and "join(complement(...),...)".
+    Same as Bio.SeqFeature.Location.fromstring for these formats.
+    Return:
+        location(FeatureLocation or CompoundLocation or None): None if not
+        supported
+    """
+    def simple(text, strand):
+        match = SIMPLE.match(text)
+        if match is None:
+            return None
+        start = int(match.group(2)) - 1
+        if match.group(4) is None:
+            end = start + 1
+        else:
+            end = int(match.group(4))
+        if start > end:
+            # across the origin of circular genome
+            return None
+        return FeatureLocation(start, end, strand)
+
+    strand = 1
+    reverse = False
+    if location.startswith('complement(') and location.endswith(')'):
+        location = location[11:-1]
+        strand = -1
+        reverse = True
+    operator = ''
+    for i in ('join', 'order'):
+        if location.startswith(i+'(') and location.endswith(')'):
+            operator = i
+            location = location[len(i)+1:-1]
+            break
+    if not operator:
+        return simple(location, strand)
+    parts = []
+    for text in location.split(','):
+        part_strand = strand
+        if text.startswith('complement(') and text.endswith(')'):
+            if reverse:
+                return None
+            text = text[11:-1]
+            part_strand = -1
+        part = simple(text, part_strand)
+        if part is None:
+            return None
+        parts.append(part)
+    if reverse:
+        parts.reverse()
+    if len(parts) == 1:
+        return parts[0]
+    return CompoundLocation(parts, operator)
+
+
+def parse_qualifiers(lines: list, keys: set) -> dict:
+    """
+    Parse qualifier lines of one feature, only keep given keys.
+    Multiline values are joined by space, same as Bio.SeqIO.
+    Args:
+        lines(list): lines without indent
+        keys(set): qualifiers to keep
+    Return:
+        qualifiers(dict): {key: [value, ...]}
+    """
+    qualifiers = {}
+    key = None
+    value = None
+    n = 0
+    while n < len(lines):
+        line = lines[n]
+        n += 1
+        if not line.startswith('/'):
+            # unquoted continuation
+            if value is None:
+                raise ValueError(f'Bad qualifier line {line}')
+            if key in keys:
+                qualifiers[key][-1] += ' ' + line
+            continue
+        i = line.find('=')
+        if i == -1:
+            # qualifier without value, e.g. /pseudo
+            key = line[1:]
+            value = None
+            if key in keys and key not in qualifiers:
+                qualifiers[key] = ['']
+            continue
+        key = line[1:i]
+        value = line[i+1:]
+        if value.startswith(' ') and value.lstrip().startswith('"'):
+            value = value.lstrip()
+        if len(value) > 1 and value[0] == '"':
+            value_list = [value]
+            # escaped quote is "", the value is closed by odd quote
+            quotes = value.count('"')
+            while quotes % 2 != 0:
+                if n == len(lines):
+                    raise ValueError(f'Unfinished qualifier {key}')
+                value_list.append(lines[n])
+                quotes += lines[n].count('"')
+                n += 1
+            value = ' '.join(value_list)
+        if key not in keys:
+            continue
+        if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+        value = value.replace('""', '"')
+        qualifiers.setdefault(key, []).append(value)
+    return qualifiers
+
+
+def parse_features(table: str) -> list:
+    """
+    Parse feature table. Only keep the first feature (usually "source") and
+    features that divide use, other features are skipped without parsing.
+    Args:
+        table(str): lines after "FEATURES"
+    Return:
+        features(list): [SeqFeature]
+    """
+    features = []
+    keys_lines = list(FEATURE_KEY.finditer(table))
+    for index, match in enumerate(keys_lines):
+        key = match.group(1)
+        keys = set()
+        # divide read specimen info from the first feature
+        if index == 0:
+            keys |= SOURCE_KEYS
+        if key in ACCEPT_TYPE:
+            keys |= NAME_KEYS
+        if not keys:
+            continue
+        if match.start(2) - match.start() != 21:
+            raise ValueError('Over indented feature')
+        if index == len(keys_lines) - 1:
+            end = len(table)
+        else:
+            end = keys_lines[index+1].start()
+        feature_lines = [i.strip() for i in
+                         table[match.start(2):end].split('\n')]
+        feature_lines = [i for i in feature_lines if i]
+        location = feature_lines[0]
+        n = 1
+        while (location.endswith(',') or
+               location.count('(') > location.count(')')):
+            if n == len(feature_lines):
+                raise ValueError(f'Bad location {location}')
+            location += feature_lines[n]
+            n += 1
+        location = parse_location(location)
+        if location is None:
+            raise ValueError('Unsupported location')
+        qualifiers = parse_qualifiers(feature_lines[n:], keys)
+        features.append(SeqFeature(location, type=key, qualifiers=qualifiers))
+    return features
+
+
+def parse_feature_table(data: bytes) -> dict:
+    """
+    Parse 5-column feature table (efetch rettype "ft").
+    Qualifiers without value are kept as [''], same as SeqIO.
+    Args:
+        data(bytes): feature tables of several records
+    Return:
+        tables(dict): {accession.version: [SeqFeature]}
+    """
+    tables = {}
+    features = None
+    parts = []
+    feature_type = ''
+    qualifiers = {}
+
+    def add_feature():
+        if features is None or not parts:
+            return
+        if len(parts) == 1:
+            location = parts[0]
+        else:
+            location = CompoundLocation(parts, 'join')
+        features.append(SeqFeature(location, type=feature_type,
+                                   qualifiers=qualifiers))
+
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        if not line.strip():
+            continue
+        if line.startswith('>Feature'):
+            add_feature()
+            parts = []
+            # ">Feature gb|AB000001.1|" or ">Feature AB000001.1"
+            words = line[8:].strip().split('|')
+            accession = ([i for i in words if '.' in i] or words)[0]
+            features = tables.setdefault(accession, [])
+            continue
+        columns = line.split('\t')
+        if columns[0]:
+            # location line, the first part has feature key
+            if len(columns) > 2 and columns[2]:
+                add_feature()
+                parts = []
+                feature_type = columns[2].strip()
+                qualifiers = {}
+            try:
+                start, end = [int(i.strip('<>').split('^')[0])
+                              for i in columns[:2]]
+            except ValueError:
+                continue
+            strand = 1 if start <= end else -1
+            start, end = min(start, end), max(start, end)
+            parts.append(FeatureLocation(start-1, end, strand))
+        elif len(columns) > 3:
+            key = columns[3].strip()
+            value = columns[4].strip() if len(columns) > 4 else ''
+            qualifiers.setdefault(key, []).append(value)
+    add_feature()
+    return tables
+
+
+def parse_fasta(data: bytes) -> dict:
+    """
+    Parse fasta returned by efetch.
+    Return:
+        sequences(dict): {accession.version: sequence(bytes)}, in order
+    """
+    sequences = {}
+    for record in data.split(b'\n>'):
+        record = record.lstrip(b'>')
+        if not record.strip():
+            continue
+        title, _, sequence = record.partition(b'\n')
+        # ">AB000001.1 title" or ">gi|1|gb|AB000001.1| title"
+        words = title.decode('utf-8', errors='replace').split()[0].split('|')
+        accession = ([i for i in words if '.' in i] or words)[0]
+        sequences[accession] = sequence.translate(None, b' \r\n')
+    return sequences
+
+
+def format_location(location) -> str:
+    """
+    Convert location to genbank format, reverse of parse_location.
+    """
+    def simple(part):
+        if part.end - part.start == 1:
+            return str(part.start+1)
+        return f'{part.start+1}..{part.end}'
+
+    parts = location.parts
+    if len(parts) == 1:
+        text = simple(parts[0])
+        return f'complement({text})' if parts[0].strand == -1 else text
+    if all(i.strand == -1 for i in parts):
+        text = ','.join(simple(i) for i in reversed(parts))
+        return f'complement(join({text}))'
+    text = ','.join(f'complement({simple(i)})' if i.strand == -1 else
+                    simple(i) for i in parts)
+    return f'join({text})'
+
+
+def make_record(accession: str, features: list, sequence: bytes,
+                taxonomy: list, organism=None) -> bytes:
+    """
+    Generate minimal genbank record with fields that divide needs, from
+    feature table and fasta.
+    Args:
+        accession(str): accession.version
+        features(list): [SeqFeature], the first should be "source"
+        sequence(bytes): sequence
+        taxonomy(list): lineage, from high rank to low rank
+        organism(str or None): if None, use "organism" of source feature
+    Return:
+        record(bytes): genbank record
+    """
+    if not features or features[0].type != 'source':
+        features = [SeqFeature(FeatureLocation(0, len(sequence), 1),
+                               type='source', qualifiers={}), *features]
+    if organism is None:
+        organism = features[0].qualifiers.get('organism', ['Unknown'])[0]
+    lines = [f'LOCUS       {accession.split(".")[0]:<16} {len(sequence):>11} '
+             f'bp    DNA     linear   UNK 01-JAN-1980',
+             f'ACCESSION   {accession.split(".")[0]}',
+             f'VERSION     {accession}',
+             f'SOURCE      {organism}',
+             f'  ORGANISM  {organism}']
+    lineage = '; '.join(taxonomy) + '.'
+    # keep lines short
+    while lineage:
+        if len(lineage) <= 68:
+            lines.append(HEADER_INDENT+lineage)
+            break
+        cut = lineage.rfind(' ', 0, 68)
+        if cut <= 0:
+            cut = len(lineage)
+        lines.append(HEADER_INDENT+lineage[:cut])
+        lineage = lineage[cut+1:]
+    lines.append('FEATURES             Location/Qualifiers')
+    for feature in features:
+        lines.append(f'     {feature.type:<16}'
+                     f'{format_location(feature.location)}')
+        for key, values in feature.qualifiers.items():
+            for value in values:
+                if value:
+                    value = value.replace('"', '""')
+                    lines.append(f'{FEATURE_INDENT}/{key}="{value}"')
+                else:
+                    lines.append(f'{FEATURE_INDENT}/{key}')
+    lines.append('ORIGIN')
+    text = sequence.decode('ascii', errors='replace').lower()
+    for i in range(0, len(text), 60):
+        blocks = [text[j:j+10] for j in range(i, min(i+60, len(text)), 10)]
+        lines.append(f'{i+1:>9} ' + ' '.join(blocks))
+    lines.extend(('//', ''))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def origin_length(raw: bytes, start: int, end: int):
+    """
+    Check layout of ORIGIN lines and get sequence length. Only the first and
+    the last line are checked, lines in the middle are located by the
+    position of the last line.
+    Args:
+        raw(bytes): one record
+        start(int): start of the first line
+        end(int): end of the last line, i.e., the position of "\n//"
+    Return:
+        length(int or None): None if the layout is not standard
+    """
+    if end <= start or raw[start:start+10] != b'        1 ':
+        return None
+    last = raw.rfind(b'\n', start, end) + 1
+    if last == 0:
+        last = start
+    full_lines, left = divmod(last-start, ORIGIN_LINE)
+    if left != 0:
+        return None
+    line = raw[last:end].rstrip(b'\r ')
+    try:
+        position = int(line[:9])
+    except ValueError:
+        return None
+    bases = len(line) - 10 - (len(line)-10) // 11
+    if (position != full_lines*ORIGIN_BASES+1 or line[9:10] != b' ' or
+            not 0 < bases <= ORIGIN_BASES):
+        return None
+    return full_lines*ORIGIN_BASES + bases
+
+
+if SequenceDataAbstractBaseClass is not None:
+    class LazySequence(SequenceDataAbstractBaseClass):
+        """
+        Sequence in ORIGIN lines of a raw record, only requested regions are
+        decoded, e.g., extracting a gene from a huge genome only reads the
+        gene. The layout should be checked by origin_length.
+        """
+        __slots__ = ('raw', 'start', 'length')
+
+        def __init__(self, raw: bytes, start: int, length: int):
+            """
+            Args:
+                raw(bytes): one record
+                start(int): start of the first line of ORIGIN
+                length(int): sequence length
+            """
+            self.raw = raw
+            self.start = start
+            self.length = length
+            super().__init__()
+
+        def __len__(self):
+            return self.length
+
+        def _offset(self, index: int) -> int:
+            line, column = divmod(index, ORIGIN_BASES)
+            return (self.start + line*ORIGIN_LINE + 10 + column +
+                    column//10)
+
+        def __getitem__(self, key):
+            if isinstance(key, slice):
+                start, stop, step = key.indices(self.length)
+                if step != 1:
+                    return self[:][key]
+                if start >= stop:
+                    return b''
+                return self.raw[self._offset(start):self._offset(
+                    stop-1)+1].translate(None, NOT_BASE).upper()
+            if key < 0:
+                key += self.length
+            if not 0 <= key < self.length:
+                raise IndexError('sequence index out of range')
+            offset = self._offset(key)
+            return self.raw[offset:offset+1].upper()[0]
+else:
+    LazySequence = None
+
+
+def get_parts(location) -> list:
+    """
+    Convert location to plain tuples for extract.
+    Args:
+        location(FeatureLocation or CompoundLocation): location
+    Return:
+        parts(list): [(start, end, strand)], in order of location.parts, part
+        of other sequence has the fourth item, its accession
+    """
+    parts = []
+    for part in location.parts:
+        if part.ref or part.ref_db:
+            parts.append((int(part.start), int(part.end), part.strand,
+                          part.ref))
+        else:
+            parts.append((int(part.start), int(part.end), part.strand))
+    return parts
+
+
+def get_data(sequence):
+    """
+    Get data of the whole sequence for extract without copy. Lazy sequence
+    of scan_record is kept.
+    Args:
+        sequence(Seq): sequence
+    Return:
+        data(memoryview or LazySequence): data
+    Raise ValueError if the sequence is undefined, e.g., CONTIG records.
+    """
+    data = getattr(sequence, '_data', None)
+    if LazySequence is not None and isinstance(data, LazySequence):
+        return data
+    if isinstance(data, (bytes, bytearray)):
+        return memoryview(data)
+    return memoryview(str(sequence).encode('ascii'))
+
+
+def extract(data, parts: list) -> str:
+    """
+    Extract sequence of parts, same as SeqFeature.extract. Parts are sliced
+    without copy and are joined once.
+    Args:
+        data(memoryview or LazySequence): returned by get_data
+        parts(list): [(start, end, strand)] returned by get_parts
+    Return:
+        sequence(str): sequence
+    """
+    if len(parts) == 1 and parts[0][2] != -1 and len(parts[0]) == 3:
+        start, end, _ = parts[0]
+        return str(data[start:end], 'ascii')
+    fragments = []
+    for start, end, strand, *ref in parts:
+        if ref:
+            raise ValueError(f'Feature references another sequence '
+                             f'({ref[0]})')
+        if strand == -1:
+            fragments.append(bytes(data[start:end])[::-1].translate(
+                COMPLEMENT))
+        else:
+            fragments.append(data[start:end])
+    return str(b''.join(fragments), 'ascii')
+
+
+def write_fasta(handle, title: str, data, block=FASTA_BLOCK):
+    """
+    Write sequence in fasta format, same as SeqRecord.format('fasta') with
+    empty description. ORIGIN lines of lazy sequence already have 60 bases,
+    only digits and spaces are removed. The sequence is written by blocks
+    of lines instead of being decoded at once.
+    Args:
+        handle(TextIO): output
+        title(str): sequence id
+        data(memoryview or LazySequence): returned by get_data
+        block(int): number of lines of each write
+    """
+    handle.write(f'>{title}\n')
+    length = len(data)
+    if length == 0:
+        return
+    if LazySequence is not None and isinstance(data, LazySequence):
+        # the last line may be shorter
+        end = data._offset(length-1) + 1
+        step = ORIGIN_LINE * block
+        for start in range(data.start, end, step):
+            handle.write(str(data.raw[start:min(start+step, end)].translate(
+                UPPER, ORIGIN_NUMBER), 'ascii'))
+        handle.write('\n')
+        return
+    step = ORIGIN_BASES * block
+    for start in range(0, length, step):
+        chunk = bytes(data[start:start+step])
+        handle.write(str(b'\n'.join(
+            [chunk[i:i+ORIGIN_BASES] for i in range(
+                0, len(chunk), ORIGIN_BASES)]), 'ascii'))
+        handle.write('\n')
+
+
+def scan_record(raw: bytes):
+    """
+    Extract fields that divide needs from one genbank record, including
+    accession, organism, taxonomy, qualifiers of source feature, accepted
+    features and sequence.
+    Much faster than SeqIO.read because other fields are skipped.
+    Args:
+        raw(bytes): one record
+    Return:
+        record(SeqRecord or None): None if the record is too complex to scan
+    """
+    if not raw.startswith(b'LOCUS'):
+        return None
+    origin = raw.find(b'\nORIGIN')
+    if origin == -1:
+        return None
+    seq_start = raw.find(b'\n', origin+1)
+    seq_end = raw.rfind(b'\n//')
+    if seq_start == -1 or seq_end < seq_start:
+        return None
+    length = None
+    if LazySequence is not None:
+        length = origin_length(raw, seq_start+1, seq_end)
+    if length is None:
+        sequence = raw[seq_start:seq_end].translate(None, NOT_BASE).upper()
+    else:
+        sequence = LazySequence(raw, seq_start+1, length)
+    lines = raw[:origin].decode('utf-8', errors='replace').split('\n')
+    annotations = {}
+    accessions = []
+    version = ''
+    features = None
+    n = 0
+    while n < len(lines):
+        line = lines[n].rstrip()
+        n += 1
+        if line.startswith('ACCESSION'):
+            accessions.extend(line[12:].replace(';', ' ').split())
+            while n < len(lines) and lines[n].startswith(HEADER_INDENT):
+                accessions.extend(lines[n].replace(';', ' ').split())
+                n += 1
+        elif line.startswith('VERSION'):
+            version = line[12:].split(' ')[0]
+        elif line.startswith('  ORGANISM'):
+            organism = line[12:]
+            lineage = ''
+            while n < len(lines) and lines[n].startswith(HEADER_INDENT):
+                next_line = lines[n].rstrip()
+                n += 1
+                if lineage or ';' in next_line:
+                    lineage += ' ' + next_line[12:]
+                elif next_line[12:].strip() == '.':
+                    pass
+                else:
+                    organism += ' ' + next_line[12:].strip()
+            annotations['organism'] = organism
+            lineage = lineage.strip()
+            if not lineage or lineage == '.':
+                taxonomy = []
+            else:
+                if lineage.endswith('.'):
+                    lineage = lineage[:-1]
+                taxonomy = [i.strip() for i in lineage.split(';') if i]
+            annotations['taxonomy'] = taxonomy
+        elif line.startswith('FEATURES'):
+            end = n
+            while end < len(lines) and lines[end][:1] in (' ', ''):
+                end += 1
+            try:
+                features = parse_features('\n'.join(lines[n:end]))
+            except ValueError:
+                return None
+            n = end
+    if not features or not sequence:
+        # let SeqIO handle it
+        return None
+    if not accessions and version.count('.') == 1:
+        accessions.append(version.split('.')[0])
+    if accessions:
+        annotations['accessions'] = accessions
+    record = SeqRecord(Seq(sequence), id=version or ''.join(accessions[:1]),
+                       description='', annotations=annotations,
+                       features=features)
+    return record
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+import gzip
+import io
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
+
+# uncompressed size of one BGZF block, same as samtools, leave space for
+# incompressible data
+BGZF_BLOCK = 0xff00
+# gzip header with "BC" extra field, the last field is block size - 1
+BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000'
+                         '000000')
+# compress several blocks at once
+BGZF_BATCH = BGZF_BLOCK * 16
+GZIP_MAGIC = b'\x1f\x8b'
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """
+    Threads shared by all BgzfWriter, zlib releases the GIL.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=cpu_count() or 1)
+    return _pool
+
+
+def compress_block(data: bytes, level=6) -> bytes:
+    """
+    Compress data no longer than BGZF_BLOCK into one BGZF block.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                              BGZF_HEADER.size+len(compressed)+8-1)
+    return b''.join([header, compressed,
+                     struct.pack('<2I', zlib.crc32(data), len(data))])
+
+
+class BgzfWriter(io.BufferedIOBase):
+    """
+    Write BGZF file, i.e., gzip file of independent blocks, which could be
+    read by gzip and samtools.
+    Blocks are compressed by several threads. Data is written on block
+    boundary after flush(), so the file could be truncated to any offset
+    returned by tell() after flush().
+    """
+    def __init__(self, filename: Path, mode='wb', level=6):
+        """
+        Args:
+            filename(Path): output
+            mode(str): "wb" or "ab"
+            level(int): compress level
+        """
+        self.raw = open(filename, mode)
+        self.level = level
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _compress(self, final=False):
+        n = len(self.buffer)
+        if not final:
+            n -= n % BGZF_BLOCK
+        if n == 0:
+            return
+        blocks = [bytes(self.buffer[i:min(n, i+BGZF_BLOCK)])
+                  for i in range(0, n, BGZF_BLOCK)]
+        del self.buffer[:n]
+        levels = [self.level] * len(blocks)
+        self.raw.write(b''.join(get_pool().map(compress_block, blocks,
+                                               levels)))
+
+    def write(self, data) -> int:
+        self.buffer.extend(data)
+        if len(self.buffer) >= BGZF_BATCH:
+            self._compress()
+        return len(data)
+
+    def flush(self):
+        if self.raw.closed:
+            return
+        self._compress(final=True)
+        self.raw.flush()
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+    def truncate(self, size=None) -> int:
+        self.flush()
+        return self.raw.truncate(size)
+
+    def close(self):
+        if self.raw.closed:
+            return
+        self.flush()
+        self.raw.write(BGZF_EOF)
+        self.raw.close()
+        super().close()
+
+
+def is_compressed(filename: Path) -> bool:
+    """
+    Check gzip magic number of file.
+    """
+    try:
+        with open(filename, 'rb') as raw:
+            return raw.read(2) == GZIP_MAGIC
+    except OSError:
+        return False
+
+
+def open_file(filename: Path, mode='r', compress=False):
+    """
+    Open file for reading, gzip or BGZF file is decompressed transparently.
+    For writing, use BGZF if compress is True.
+    Args:
+        filename(Path): filename
+        mode(str): "r", "rb", "w", "wb", "a" or "ab"
+        compress(bool): compress written data or not
+    Return:
+        handle: file object
+    """
+    binary = 'b' in mode
+    if mode.startswith('r'):
+        if is_compressed(filename):
+            if binary:
+                return gzip.open(filename, 'rb')
+            return gzip.open(filename, 'rt', encoding='utf-8')
+    elif compress:
+        handle = BgzfWriter(filename, mode[0]+'b')
+        if binary:
+            return handle
+        return io.TextIOWrapper(handle, encoding='utf-8')
+    if binary:
+        return open(filename, mode)
+    return open(filename, mode, encoding='utf-8')
+
+
+def compress_file(filename: Path) -> Path:
+    """
+    Compress plain file in place.
+    """
+    tmp = filename.with_name(filename.name+'.tmp')
+    with open(filename, 'rb') as raw, BgzfWriter(tmp) as out:
+        for data in iter(lambda: raw.read(BGZF_BATCH), b''):
+            out.write(data)
+    tmp.replace(filename)
+    return filename
+
+
+def decompress_file(filename: Path, output: Path) -> Path:
+    """
+    Write decompressed data of filename to output, for programs that could
+    not read compressed files.
+    """
+    with open_file(filename, 'rb') as raw, open(output, 'wb') as out:
+        for data in iter(lambda: raw.read(BGZF_BATCH), b''):
+            out.write(data)
+    return output
+
+
+def decompress(chunks):
+    """
+    Decompress gzip data of several members, e.g. BGZF blocks.
+    Args:
+        chunks(Iterable): compressed data
+    Yield:
+        data(bytes): decompressed data
+    """
+    decompressor = zlib.decompressobj(31)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+            else:
+                chunk = b''
+
+
+class FastaWriter:
+    """
+    Append text to many files with few open() calls.
+    Data of each file is buffered in memory and is written by a separate
+    thread when the buffer is large enough. Open handles are kept in a LRU
+    pool. Data of the same file is always written in order.
+    Use it as context manager or call close() at the end.
+    """
+    def __init__(self, max_handles=128, buffer_size=1024*1024,
+                 max_buffer=64*1024*1024, compress=False):
+        """
+        Args:
+            max_handles(int): maximum number of open files
+            buffer_size(int): flush one file if its buffer reaches the size
+            max_buffer(int): flush all files if total buffer reaches the size
+            compress(bool): write BGZF files or not
+        """
+        self.max_handles = max_handles
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.max_buffer = max_buffer
+        self.buffer = {}
+        self.buffer_len = {}
+        self.total = 0
+        self.handles = OrderedDict()
+        self.error = None
+        # limit memory if disk is slower than dividing
+        self.queue = Queue(maxsize=64)
+        self.thread = Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_handle(self, filename: Path):
+        handle = self.handles.get(filename, None)
+        if handle is not None:
+            self.handles.move_to_end(filename)
+            return handle
+        if len(self.handles) >= self.max_handles:
+            _, old = self.handles.popitem(last=False)
+            old.close()
+        handle = open_file(filename, 'a', self.compress)
+        self.handles[filename] = handle
+        return handle
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # keep receiving data to avoid blocking the main thread
+            if self.error is not None:
+                continue
+            filename, data = item
+            try:
+                self._get_handle(filename).write(data)
+            except Exception as e:
+                self.error = e
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _flush_file(self, filename: Path):
+        data = ''.join(self.buffer.pop(filename))
+        self.total -= self.buffer_len.pop(filename)
+        self.queue.put((filename, data))
+
+    def write(self, filename: Path, data: str):
+        """
+        Append data to filename.
+        """
+        self._check()
+        self.buffer.setdefault(filename, []).append(data)
+        self.buffer_len[filename] = self.buffer_len.get(filename, 0) + len(
+            data)
+        self.total += len(data)
+        if self.buffer_len[filename] >= self.buffer_size:
+            self._flush_file(filename)
+        elif self.total >= self.max_buffer:
+            self.flush()
+
+    def flush(self):
+        """
+        Send all buffered data to the writer thread.
+        """
+        for filename in list(self.buffer.keys()):
+            self._flush_file(filename)
+
+    def close(self):
+        """
+        Write all data and close files.
+        """
+        if not self.thread.is_alive():
+            return
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
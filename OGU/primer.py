@@ -22,6 +22,7 @@ from primer3 import (calcTm, calcHairpinTm, calcHomodimerTm,
 from OGU import utils
 from OGU import evaluate
 from OGU.global_vars import log
+from OGU.output import open_file
 
 
 class Pair:
@@ -498,7 +499,7 @@ def old_remove_gap(aln_fasta: Path, new_file: Path) -> Path:
         new_file: fasta without gap
     """
     no_gap = StringIO()
-    with open(aln_fasta, 'r', encoding='utf-8') as raw:
+    with open_file(aln_fasta, 'r') as raw:
         for line in raw:
             no_gap.write(line.replace('-', ''))
     # try to avoid makeblastdb error
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# robust z-score = 0.6745 * (x - median) / MAD
+MAX_Z = 5.0
+# minimum MAD of log(length), avoid removing normal sequences if most
+# sequences have same length
+MIN_LOG_MAD = 0.1
+# minimum distance to centroid to be considered as outlier
+MIN_DISTANCE = 0.2
+MAX_AMBIGUOUS = 0.1
+# too few sequences to estimate the distribution
+MIN_SEQS = 5
+# k-mer length of profile, 4^K columns
+K = 3
+# profile of short sequence is too noisy
+MIN_PROFILE_LEN = 500
+# count sequences by chunks of bases to limit memory
+CHUNK_BASES = 4 * 1024 * 1024
+# A/C/G/T to 0/1/2/3, others to 255
+CODE = np.full(256, 255, dtype=np.uint8)
+for _n, _base in enumerate(b'ACGT'):
+    CODE[_base] = _n
+    CODE[ord(chr(_base).lower())] = _n
+
+
+def robust_z(values: np.ndarray, min_mad=0.0) -> np.ndarray:
+    median = np.median(values)
+    mad = max(np.median(np.abs(values-median)), min_mad)
+    if mad == 0:
+        return np.zeros(len(values))
+    return 0.6745 * (values-median) / mad
+
+
+def count_chunk(sequences: list, profile=True):
+    """
+    Count ambiguous bases and k-mers of a few sequences at once. Positions
+    are coded by uint8/uint32, memory is several bytes per base.
+    Args:
+        sequences(list): [bytes]
+        profile(bool): count k-mers or not
+    Return:
+        ambiguous(np.ndarray): number of ambiguous bases of each sequence
+        counts(np.ndarray or None): number of k-mers, one row per sequence
+    """
+    n_seqs = len(sequences)
+    lengths = np.array([len(i) for i in sequences], dtype=np.int64)
+    codes = CODE[np.frombuffer(b''.join(sequences), dtype=np.uint8)]
+    seq_index = np.repeat(np.arange(n_seqs, dtype=np.uint32), lengths)
+    ambiguous = np.bincount(seq_index[codes == 255], minlength=n_seqs)
+    if not profile:
+        return ambiguous, None
+    n = len(codes) - K + 1
+    if n <= 0:
+        return ambiguous, np.zeros((n_seqs, 4**K), dtype=np.uint32)
+    kmers = np.zeros(n, dtype=np.uint8)
+    valid = seq_index[:n] == seq_index[K-1:]
+    for i in range(K):
+        kmers = kmers * 4 + (codes[i:i+n] & 3)
+        valid &= codes[i:i+n] != 255
+    keys = seq_index[:n][valid] * np.uint32(4**K) + kmers[valid]
+    counts = np.bincount(keys, minlength=n_seqs*4**K).reshape(
+        n_seqs, 4**K).astype(np.uint32)
+    return ambiguous, counts
+
+
+def screen(sequences: list, chunk=CHUNK_BASES) -> list:
+    """
+    Find abnormal sequences of one locus before alignment, including length
+    outliers, sequences with too many ambiguous bases and sequences whose
+    k-mer profile is far from the centroid of the locus.
+    Sequences are counted by chunks to limit memory.
+    Args:
+        sequences(list): [bytes]
+        chunk(int): number of bases of each chunk
+    Return:
+        reasons(list): [reason(str), value(float)] for each sequence, reason
+        is None if the sequence is ok
+    """
+    n_seqs = len(sequences)
+    reasons = [[None, 0.0] for _ in range(n_seqs)]
+    if n_seqs == 0:
+        return reasons
+    lengths = np.array([len(i) for i in sequences], dtype=np.int64)
+    long_seqs = np.flatnonzero(lengths >= MIN_PROFILE_LEN)
+    profile = n_seqs >= MIN_SEQS and len(long_seqs) >= MIN_SEQS
+    ambiguous = np.zeros(n_seqs, dtype=np.int64)
+    counts = np.zeros((n_seqs, 4**K), dtype=np.uint32) if profile else None
+    start = 0
+    while start < n_seqs:
+        end = start + 1
+        size = lengths[start]
+        while end < n_seqs and size+lengths[end] <= chunk:
+            size += lengths[end]
+            end += 1
+        chunk_ambiguous, chunk_counts = count_chunk(sequences[start:end],
+                                                    profile)
+        ambiguous[start:end] = chunk_ambiguous
+        if profile:
+            counts[start:end] = chunk_counts
+        start = end
+    ambiguous = ambiguous / np.maximum(lengths, 1)
+    for i in np.flatnonzero(ambiguous > MAX_AMBIGUOUS):
+        reasons[i] = ['ambiguous', float(ambiguous[i])]
+    if n_seqs < MIN_SEQS:
+        return reasons
+    # use log to find oversized sequences, e.g. 20 kb "rbcL"
+    length_z = robust_z(np.log(np.maximum(lengths, 1)), MIN_LOG_MAD)
+    for i in np.flatnonzero(np.abs(length_z) > MAX_Z):
+        if reasons[i][0] is None:
+            reasons[i] = ['length', float(lengths[i])]
+    if not profile:
+        return reasons
+    counts = counts[long_seqs]
+    total = np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    profile = counts / total
+    centroid = np.median(profile, axis=0)
+    # total variation distance, in [0, 1]
+    distance = np.abs(profile-centroid).sum(axis=1) / 2
+    distance_z = robust_z(distance)
+    for i in np.flatnonzero((distance_z > MAX_Z) &
+                            (distance > MIN_DISTANCE)):
+        if reasons[long_seqs[i]][0] is None:
+            reasons[long_seqs[i]] = ['kmer', float(distance[i])]
+    return reasons
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+
+import mmap
+import struct
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from pkg_resources import resource_filename
+
+from OGU.global_vars import log, name
+
+# ranks used in sequence id, "domain" is the new name of "superkingdom"
+RANKS = ('', 'superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family')
+RANK_CODE = {rank: code for code, rank in enumerate(RANKS)}
+RANK_CODE['domain'] = RANK_CODE['superkingdom']
+MAGIC = b'OGUTAX1\x00'
+# magic, number of taxon ids, length of names
+HEADER = struct.Struct('<8sII')
+INDEX_FILE = 'taxonomy.idx'
+# names of taxonomy groups for get_taxon in gb2fasta
+LINEAGE_FILE = 'lineage.idx'
+LINEAGE_TABLES = ('superkingdoms', 'kingdoms', 'phyla', 'classes',
+                  'animal_orders')
+LINEAGE_MAGIC = b'OGULIN1\x00'
+# number of names, length of names
+TABLE_HEADER = struct.Struct('<II')
+
+
+def write_index(id_parent: dict, id_rank: dict, id_name: dict,
+                index_file: Path) -> Path:
+    """
+    Write taxonomy index for get_ranks.
+    Arrays are indexed by taxon id, only names of RANKS are kept.
+    Layout: header, parent(int32), name offset(uint32), rank(uint8), names.
+    Args:
+        id_parent(dict): {taxon_id(int): parent_id(int)}
+        id_rank(dict): {taxon_id(int): rank(str)}
+        id_name(dict): {taxon_id(int): scientific name(str)}
+        index_file(Path): output
+    Return:
+        index_file(Path): output
+    """
+    n = max(id_parent) + 1
+    parent = array('i', [0]) * n
+    rank = array('B', [0]) * n
+    offset = array('I', [0]) * (n+1)
+    names = bytearray()
+    for taxon_id in range(n):
+        offset[taxon_id] = len(names)
+        if taxon_id not in id_parent:
+            continue
+        parent[taxon_id] = id_parent[taxon_id]
+        code = RANK_CODE.get(id_rank.get(taxon_id, ''), 0)
+        rank[taxon_id] = code
+        if code != 0:
+            names.extend(id_name.get(taxon_id, '').encode('utf-8'))
+    offset[n] = len(names)
+    with open(index_file, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, n, len(names)))
+        for i in (parent, offset, rank):
+            # index file is always little endian
+            if struct.pack('=I', 1) != struct.pack('<I', 1):
+                i.byteswap()
+            out.write(i.tobytes())
+        out.write(names)
+    return index_file
+
+
+class TaxonomyIndex:
+    """
+    Memory-mapped taxonomy index written by write_index.
+    Ranks of each taxon id are looked up by walking to the root and are
+    cached.
+    """
+    def __init__(self, index_file: Path):
+        self.index_file = index_file
+        with open(index_file, 'rb') as raw:
+            # the map is still valid after the file is closed
+            self.data = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, names_len = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f'Invalid taxonomy index {index_file}')
+        self.n = n
+        view = memoryview(self.data)
+        start = HEADER.size
+        self.parent = view[start:start+4*n].cast('i')
+        start += 4 * n
+        self.offset = view[start:start+4*(n+1)].cast('I')
+        start += 4 * (n+1)
+        self.rank = view[start:start+n]
+        start += n
+        self.names = view[start:start+names_len]
+        self.cache = {}
+
+    def get_name(self, taxon_id: int) -> str:
+        return bytes(self.names[self.offset[taxon_id]:
+                                self.offset[taxon_id+1]]).decode('utf-8')
+
+    def get_ranks(self, taxon_id: int):
+        """
+        Get names of kingdom, phylum, class, order and family.
+        Kingdom is replaced by superkingdom if not found, same as the old
+        method.
+        Return:
+            ranks(tuple or None): (kingdom, phylum, class, order, family),
+            None if taxon id not found
+        """
+        if taxon_id in self.cache:
+            return self.cache[taxon_id]
+        if taxon_id <= 0 or taxon_id >= self.n or self.parent[taxon_id] == 0:
+            self.cache[taxon_id] = None
+            return None
+        found = {}
+        current = taxon_id
+        # root's parent is itself
+        while True:
+            code = self.rank[current]
+            if code != 0 and code not in found:
+                found[code] = self.get_name(current)
+            parent = self.parent[current]
+            if parent == current or parent == 0:
+                break
+            current = parent
+        kingdom = found.get(RANK_CODE['kingdom'],
+                            found.get(RANK_CODE['superkingdom'], ''))
+        ranks = (kingdom, *[found.get(RANK_CODE[i], '') for i in
+                            ('phylum', 'class', 'order', 'family')])
+        self.cache[taxon_id] = ranks
+        return ranks
+
+
+def write_lineage(tables: dict, lineage_file: Path) -> Path:
+    """
+    Pack lineage tables into one file for SortedNames.
+    Each table: header, name offset(uint32), sorted names, padding.
+    Args:
+        tables(dict): {table name: [names]}, keys are LINEAGE_TABLES
+        lineage_file(Path): output
+    Return:
+        lineage_file(Path): output
+    """
+    with open(lineage_file, 'wb') as out:
+        out.write(LINEAGE_MAGIC)
+        for table in LINEAGE_TABLES:
+            names = sorted({i.encode('utf-8') for i in tables[table] if i})
+            offset = array('I', [0])
+            for i in names:
+                offset.append(offset[-1]+len(i))
+            if struct.pack('=I', 1) != struct.pack('<I', 1):
+                offset.byteswap()
+            blob = b''.join(names)
+            out.write(TABLE_HEADER.pack(len(names), len(blob)))
+            out.write(offset.tobytes())
+            out.write(blob)
+            # keep offsets aligned
+            out.write(b'\x00' * (-len(blob) % 4))
+    return lineage_file
+
+
+def pack_lineage(data_folder: Path) -> Path:
+    """
+    Pack csv files of lineage tables written by utils.init_lineage.
+    """
+    tables = {}
+    for table in LINEAGE_TABLES:
+        with open(data_folder/f'{table}.csv', 'r', encoding='utf-8') as _:
+            tables[table] = _.read().split(',')
+    return write_lineage(tables, data_folder/LINEAGE_FILE)
+
+
+class SortedNames:
+    """
+    Read-only set of names in memory-mapped data, use binary search.
+    """
+    def __init__(self, view: memoryview, start: int):
+        """
+        Args:
+            view(memoryview): data written by write_lineage
+            start(int): start of the table
+        """
+        self.count, names_len = TABLE_HEADER.unpack_from(view, start)
+        start += TABLE_HEADER.size
+        self.offset = view[start:start+4*(self.count+1)].cast('I')
+        start += 4 * (self.count+1)
+        self.names = view[start:start+names_len]
+        self.end = start + names_len + (-names_len % 4)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.names[self.offset[i]:self.offset[i+1]].tobytes()
+
+    def __contains__(self, name: str) -> bool:
+        key = name.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low+high) // 2
+            if self[middle] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self[low] == key
+
+
+@lru_cache(maxsize=1)
+def get_lineage() -> dict:
+    """
+    Load lineage tables at the first call.
+    Use csv files if the packed file is not available.
+    Return:
+        lineage(dict): {table name: SortedNames or frozenset}
+    """
+    lineage_file = Path(resource_filename(name, f'data/{LINEAGE_FILE}'))
+    lineage = {}
+    if lineage_file.exists():
+        with open(lineage_file, 'rb') as raw:
+            # the map is still valid after the file is closed
+            data = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        if view[:len(LINEAGE_MAGIC)] == LINEAGE_MAGIC:
+            start = len(LINEAGE_MAGIC)
+            for table in LINEAGE_TABLES:
+                lineage[table] = SortedNames(view, start)
+                start = lineage[table].end
+            return lineage
+        log.warning(f'Invalid lineage file {lineage_file}.')
+    for table in LINEAGE_TABLES:
+        with open(resource_filename(name, f'data/{table}.csv'), 'r',
+                  encoding='utf-8') as _:
+            lineage[table] = frozenset(_.read().split(','))
+    return lineage
+
+
+@lru_cache(maxsize=None)
+def load_index(index_file=None):
+    """
+    Load taxonomy index generated by utils.init_lineage.
+    The index is loaded once in each process and is shared by all calls.
+    Return:
+        index(TaxonomyIndex or None): None if not available
+    """
+    if index_file is None:
+        index_file = Path(resource_filename(name, f'data/{INDEX_FILE}'))
+    if not index_file.exists():
+        log.debug(f'Cannot find {index_file}.')
+        return None
+    try:
+        return TaxonomyIndex(index_file)
+    except (ValueError, OSError) as e:
+        log.warning(f'Cannot load taxonomy index: {e}')
+        return None
+
+
+def get_taxon_id(qualifiers: dict):
+    """
+    Get NCBI taxon id from "db_xref" of source feature.
+    Return:
+        taxon_id(int or None): None if not found
+    """
+    for i in qualifiers.get('db_xref', []):
+        if i.startswith('taxon:'):
+            try:
+                return int(i[6:])
+            except ValueError:
+                return None
+    return None
@@ -656,7 +656,7 @@ class GB2Fasta:
         self.TCombobox_unique = my_combobox(self.top)
         self.TCombobox_unique.place(relx=0.167, rely=0.488, relheight=0.044
                                     , relwidth=0.245)
-        self.unique_value_list = ['longest', 'first', 'no', ]
+        self.unique_value_list = ['longest', 'first', 'cluster', 'no', ]
         self.TCombobox_unique.configure(values=self.unique_value_list)
         self.TCombobox_unique.configure(textvariable=self.unique)
         self.TCombobox_unique.current(0)
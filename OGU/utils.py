@@ -20,6 +20,7 @@ from pkg_resources import resource_filename
 
 from Bio.Seq import Seq
 from OGU.global_vars import log, name, FMT, DATEFMT
+from OGU.taxonomy import INDEX_FILE, pack_lineage, write_index
 
 
 # hosting in non-free AWS S3 server
@@ -644,6 +645,7 @@ def init_lineage():
         dumpfile.extract('nodes.dmp', path='.')
     id_name = {}
     id_rank = {}
+    id_parent = {}
     superkingdoms = []
     kingdoms = []
     phyla = []
@@ -663,6 +665,7 @@ def init_lineage():
             taxon_id = line[0].strip()
             rank = line[2].strip()
             id_rank[taxon_id] = rank
+            id_parent[taxon_id] = line[1].strip()
     for taxon_id in id_name:
         rank_name = id_rank[taxon_id]
         taxon_name = id_name[taxon_id]
@@ -688,6 +691,12 @@ def init_lineage():
         out.write(','.join(classes))
     with open(data_folder / 'animal_orders.csv', 'w') as out:
         out.write(','.join(animal_orders))
+    pack_lineage(data_folder)
+    # for looking up ranks by taxon id of records
+    write_index({int(i): int(j) for i, j in id_parent.items()},
+                {int(i): j for i, j in id_rank.items()},
+                {int(i): j for i, j in id_name.items()},
+                data_folder / INDEX_FILE)
     return
 
 
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+import argparse
+from io import StringIO
+from pathlib import Path
+from time import perf_counter
+
+from Bio import SeqIO
+
+from OGU import genbank
+from OGU.global_vars import log
+
+
+def parse_args():
+    arg = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Measure records/second of OGU components.')
+    arg.add_argument('gb', help='genbank file')
+    arg.add_argument('-repeat', type=int, default=3,
+                     help='repeat times, use the best result')
+    return arg.parse_args()
+
+
+def bench(function, gb: Path, repeat: int) -> (int, float):
+    """
+    Run function(gb) several times.
+    Return:
+        count(int): number of records
+        speed(float): records per second of the fastest run
+    """
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = perf_counter()
+        count = function(gb)
+        best = min(best, perf_counter()-start)
+    return count, count / max(best, 1e-9)
+
+
+def seqio_path(gb: Path) -> int:
+    # the old way of clean_gb
+    count = 0
+    for raw in genbank.read_file(gb):
+        SeqIO.read(StringIO(raw.decode('utf-8')), 'gb')
+        count += 1
+    return count
+
+
+def scanner_path(gb: Path) -> int:
+    count = 0
+    for raw in genbank.read_file(gb):
+        record = genbank.scan_record(raw)
+        if record is None:
+            SeqIO.read(StringIO(raw.decode('utf-8')), 'gb')
+        count += 1
+    return count
+
+
+def main():
+    arg = parse_args()
+    gb = Path(arg.gb).absolute()
+    log.info(f'Benchmark with {gb} ({gb.stat().st_size/1024/1024:.1f} MB).')
+    for name, function in (('SeqIO.read', seqio_path),
+                           ('genbank.scan_record', scanner_path)):
+        count, speed = bench(function, gb, arg.repeat)
+        log.info(f'\t{name:<20} {count} records, {speed:.1f} records/s')
+
+
+if __name__ == '__main__':
+    main()
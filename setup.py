@@ -21,7 +21,8 @@ setuptools.setup(
                          'data/kingdoms.csv', 'data/phyla.csv',
                          'data/superkingdoms.csv', 'data/button1.png',
                          'data/button2.png', 'data/button3.png',
-                         'data/button4.png']},
+                         'data/button4.png', 'data/lineage.idx',
+                         'data/taxonomy.idx']},
     license='GNU AGPL v3',
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, sleep
+from urllib.parse import parse_qs
+
+import pytest
+
+from OGU import entrez, genbank
+
+TABLE = b'''>Feature gb|AB000001.1|
+1\t20\tsource
+\t\t\torganism\tTest test
+1\t9\tgene
+\t\t\tgene\trbcL
+>Feature gb|AB000002.1|
+1\t8\tgene
+\t\t\tgene\tmatK
+'''
+FASTA = b'''>AB000001.1 Test test
+ACGTACGTAC
+ACGTACGTAC
+>AB000002.1 Test test
+ACGTACGT
+'''
+
+
+def test_check_ft():
+    tables = genbank.parse_feature_table(TABLE)
+    entrez.check_ft(tables, genbank.parse_fasta(FASTA))
+    # truncated sequence
+    with pytest.raises(ValueError, match='incomplete'):
+        entrez.check_ft(tables, genbank.parse_fasta(
+            FASTA.replace(b'ACGTACGTAC\n>', b'>')))
+    # missing record
+    with pytest.raises(ValueError, match='only have'):
+        entrez.check_ft(tables, genbank.parse_fasta(FASTA[:44]))
+
+
+RECORDS = [f'LOCUS       AB{i:06d}\nVERSION     AB{i:06d}.1\n'
+           f'ORIGIN\n        1 acgt\n//\n'.encode() for i in range(40)]
+
+
+class FakeEUtils(BaseHTTPRequestHandler):
+    """
+    Local stand-in of efetch. The first batch is slow, so later batches
+    finish first. The first response of two batches is truncated.
+    """
+    lock = Lock()
+    times = []
+    finished = []
+    truncated = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        size = int(self.headers['Content-Length'])
+        params = {k: v[0] for k, v in parse_qs(
+            self.rfile.read(size).decode()).items()}
+        start, ret_max = int(params['retstart']), int(params['retmax'])
+        with self.lock:
+            self.times.append(monotonic())
+            first_try = start not in self.truncated
+            self.truncated.add(start)
+        data = b''.join(RECORDS[start:start+ret_max])
+        if start == 0:
+            sleep(2.5)
+        elif first_try and start == 10:
+            # cut at the end of one record
+            data = b''.join(RECORDS[start:start+ret_max-1])
+        elif first_try and start == 20:
+            data = data[:-100]
+        with self.lock:
+            self.finished.append(start)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeEUtils)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(entrez, 'EUTILS',
+                        f'http://127.0.0.1:{httpd.server_port}/')
+    yield FakeEUtils
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_batches_local_server(server):
+    client = entrez.EUtils(retry_max=3)
+    query = {'WebEnv': 'test', 'QueryKey': '1'}
+    batches = list(client.fetch_batches(query, len(RECORDS), 10))
+    assert [i[:2] for i in batches] == [(0, 10), (10, 20), (20, 30),
+                                        (30, 40)]
+    assert b''.join(i[2] for i in batches) == b''.join(RECORDS)
+    # responses arrived out of order
+    assert server.finished.index(0) > server.finished.index(10)
+    # two truncated responses were fetched again
+    assert len(server.times) == 6
+    # 3 requests per second, any 4 requests span at least 1 second
+    times = sorted(server.times)
+    assert all(b-a > 0.95 for a, b in zip(times, times[3:]))
+
+
+def test_record_cache(tmp_path):
+    cache = entrez.RecordCache(tmp_path/'cache.sqlite')
+    assert cache.add(b''.join(RECORDS[:3])) == 3
+    assert cache.get('AB000001.1') == RECORDS[1]
+    assert cache.missing(['AB000001.1', 'AB000001.2', 'AB000009.1']) == [
+        'AB000001.2', 'AB000009.1']
+    # only the newest version is kept
+    new = RECORDS[1].replace(b'AB000001.1', b'AB000001.2')
+    cache.add(new)
+    assert cache.get('AB000001.1') is None
+    assert cache.get('AB000001.2') == new
+    cache.close()
+    # records of ft mode are kept separately
+    ft_cache = entrez.RecordCache(tmp_path/'cache.sqlite', 'ft')
+    assert ft_cache.get('AB000000.1') is None
+    ft_cache.close()
+    cache = entrez.RecordCache(tmp_path/'cache.sqlite')
+    assert cache.get('AB000000.1') == RECORDS[0]
+    cache.close()
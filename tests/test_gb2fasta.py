@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+
+import random
+import re
+from argparse import Namespace
+from datetime import date, timedelta
+
+import pytest
+
+from OGU import entrez, gb2fasta
+from test_genbank import SEQUENCE, make_contig, make_gb
+
+PDAT = re.compile(r'(NOT )?\("(\d+/\d+/\d+)"\[PDAT\] : '
+                  r'"(\d+/\d+/\d+)"\[PDAT\]')
+
+
+class FakeClient:
+    """
+    Search records by publication date, as EUtils.esearch.
+    """
+    def __init__(self, dates: list):
+        self.dates = dates
+
+    def search(self, term: str) -> list:
+        selected = self.dates
+        match = PDAT.search(term)
+        if match is not None:
+            first, last = [date(*map(int, i.split('/')))
+                           for i in match.groups()[1:]]
+            outside = match.group(1) is not None
+            selected = [i for i in selected
+                        if (first <= i <= last) != outside]
+        return selected
+
+    def esearch(self, term: str, webenv=None) -> dict:
+        return {'Count': str(len(self.search(term))), 'WebEnv': 'test',
+                'QueryKey': '1'}
+
+
+def make_dates(n: int) -> list:
+    return [gb2fasta.FIRST_DAY + timedelta(days=i*37 % 15000)
+            for i in range(n)]
+
+
+def check_partitions(client, partitions: list, size: int):
+    found = []
+    for query, count in partitions:
+        part = client.search(query)
+        assert len(part) == count
+        if len(set(part)) > 1:
+            assert count <= size
+        found.extend(part)
+    assert sorted(found) == sorted(client.dates)
+
+
+def test_partition_query():
+    client = FakeClient(make_dates(1000))
+    # many records in one day could not be split
+    client.dates.extend([date(2001, 1, 1)] * 120)
+    partitions = gb2fasta.partition_query(client, 'test',
+                                          len(client.dates), 100)
+    assert len(partitions) > 10
+    check_partitions(client, partitions, 100)
+
+
+def test_partition_query_out_of_range():
+    client = FakeClient(make_dates(500))
+    client.dates.extend([date(1970, 1, 1), date.today()+timedelta(days=30)])
+    partitions = gb2fasta.partition_query(client, 'test',
+                                          len(client.dates), 100)
+    assert partitions[-1][0].startswith('(test) NOT ')
+    assert partitions[-1][1] == 2
+    check_partitions(client, partitions, 100)
+
+
+def test_partition_query_missing():
+    client = FakeClient(make_dates(500))
+    with pytest.raises(RuntimeError):
+        gb2fasta.partition_query(client, 'test', 600, 100)
+
+
+def test_refresh_query():
+    client = FakeClient(make_dates(50))
+    checkpoint = {'Query': 'test', 'Search': 'test', 'Accessions': None,
+                  'Total': 50, 'Count': 20, 'WebEnv': 'old',
+                  'QueryKey': '9'}
+    assert gb2fasta.refresh_query(client, checkpoint)
+    assert checkpoint['WebEnv'] == 'test'
+    assert checkpoint['QueryKey'] == '1'
+    checkpoint['Total'] = 49
+    assert not gb2fasta.refresh_query(client, checkpoint)
+
+
+def test_divide_skip_contig(tmp_path):
+    gbfile = tmp_path / 'contig.gb'
+    gbfile.write_bytes(make_contig('AB000009', 100) +
+                       make_gb('AB000002', SEQUENCE, ['1..30']))
+    arg, _ = gb2fasta.gb2fasta_main(f'-gb {gbfile} -out {tmp_path/"out"}')
+    assert arg is not None
+    fasta = (arg._fasta/'contig.fasta').read_text()
+    assert 'AB000002' in fasta
+    assert 'AB000009' not in fasta
+
+
+def test_simulate_batches():
+    batches, seconds, last_size = gb2fasta.simulate_batches(50, 9000, 3, 10)
+    assert (batches, last_size) == (5, 20)
+    # batches start small and grow, see entrez.BatchSize
+    batches, seconds, last_size = gb2fasta.simulate_batches(
+        100000, 9000, 3, 1000)
+    assert 100000 / last_size < batches < 100000 / entrez.START_RET_MAX
+    assert seconds > batches / 3 * gb2fasta.REQUEST_SECONDS
+
+
+def test_cluster_for_unique_by_species(tmp_path):
+    rand = random.Random(1)
+    sequence = ''.join(rand.choice('ACGT') for _ in range(600))
+    ids = ['rbcL|K|P|C|O|F|Poa|annua|A1|s|gene',
+           'rbcL|K|P|C|O|F|Poa|annua|A2|s|gene',
+           'rbcL|K|P|C|O|F|Poa|sativa|A3|s|gene']
+    fasta = tmp_path / 'gene-rbcL.fasta'
+    fasta.write_text(''.join(f'>{i}\n{sequence}\n' for i in ids))
+    arg = Namespace(_unique=tmp_path, identity=0.99)
+    keep, count = gb2fasta.cluster_for_unique(fasta, arg)
+    assert count == 3
+    # identical sequences of sister species are both kept
+    kept = [fasta.read_bytes()[a:b].split(b'|')[7] for a, b in keep]
+    assert kept == [b'annua', b'sativa']
+    tsv = (tmp_path/'gene-rbcL.cluster.tsv').read_text().splitlines()
+    assert [i.split('\t')[0] for i in tsv[1:]] == ['Poa annua'] * 2 + [
+        'Poa sativa']
+
+
+def test_count_for_unique(tmp_path):
+    records = [('rbcL|K|P|C|O|F|Poa|annua|A1|s|gene', 'ACGT'),
+               ('rbcL|K|P|C|O|F|Poa|sativa|A2|s|gene', 'ACGTAC'),
+               ('rbcL|K|P|C|O|F|Poa|annua|A3|s|gene', 'ACGTACGT\nACGT'),
+               ('rbcL|K|P|C|O|F|Poa|annua|A4|s|gene', ''),
+               ('rbcL|K|P|C|O|F|Poa|sativa|A5|s|gene', 'ACGTAC')]
+    fasta = tmp_path / 'gene-rbcL.fasta'
+    fasta.write_text(''.join(f'>{i}\n{j}\n' for i, j in records))
+    raw = fasta.read_bytes()
+
+    def kept(keep):
+        return [raw[a:b].split(b'|')[8] for a, b in keep]
+
+    keep, count = gb2fasta.count_for_unique(fasta, 'first')
+    assert count == 5
+    assert kept(keep) == [b'A1', b'A2']
+    # first one of same length, in order of the file
+    keep, count = gb2fasta.count_for_unique(fasta, 'longest')
+    assert kept(keep) == [b'A2', b'A3']
+    keep, count = gb2fasta.count_for_unique(fasta, 'no')
+    assert (keep, count) == ([], 5)
+
+
+def make_gb_file(gbfile, n=20):
+    locations = ['1..30', '50..90', '100..140']
+    records = [make_gb(f'AB{i:06d}', SEQUENCE, locations) for i in range(n)]
+    # duplicate record is removed
+    records.append(records[3])
+    gbfile.write_bytes(b''.join(records))
+    return gbfile
+
+
+def read_outputs(arg) -> dict:
+    return {f'{folder.name}/{i.name}': i.read_text()
+            for folder in (arg._fasta, arg._divide, arg._expand)
+            for i in sorted(folder.iterdir())}
+
+
+def test_parallel_divide_same_as_serial(tmp_path, monkeypatch):
+    gbfile = make_gb_file(tmp_path/'a.gb')
+    split_file = gb2fasta.genbank.split_file
+    parts = []
+
+    def small_split(gbfile, n, min_size=0):
+        ranges = split_file(gbfile, n, min_size)
+        parts.append(len(ranges))
+        return ranges
+
+    monkeypatch.setattr(gb2fasta.genbank, 'split_file', small_split)
+    outputs = []
+    for threads in (1, 2):
+        arg, _ = gb2fasta.gb2fasta_main(
+            f'-gb {gbfile} -out {tmp_path/str(threads)} -threads {threads} '
+            f'-unique no')
+        assert arg is not None
+        outputs.append(read_outputs(arg))
+    assert parts[-1] > 1
+    assert outputs[0] == outputs[1]
+    assert outputs[0]['Fasta/a.fasta'].count('>') == 20
+
+
+def test_keep_features(tmp_path):
+    gbfile = make_gb_file(tmp_path/'a.gb')
+    arg, _ = gb2fasta.gb2fasta_main(f'-gb {gbfile} -out {tmp_path/"all"} '
+                                    f'-unique no')
+    assert len(list(arg._divide.iterdir())) > 1
+    arg, _ = gb2fasta.gb2fasta_main(f'-gb {gbfile} -out {tmp_path/"kept"} '
+                                    f'-unique no -keep_features GENE0')
+    assert [i.name for i in arg._divide.iterdir()] == ['gene-gene0.fasta']
+    fasta = (arg._divide/'gene-gene0.fasta').read_text()
+    assert fasta.count('>gene0|') == 20
+    # only feature types
+    arg, _ = gb2fasta.gb2fasta_main(f'-gb {gbfile} -out {tmp_path/"type"} '
+                                    f'-unique no -keep_features spacer')
+    assert {i.name.split('-')[0] for i in arg._divide.iterdir()} == {
+        'spacer'}
+
+
+class FakePostClient(entrez.EUtils):
+    """
+    Keep posted ids in memory instead of history server.
+    """
+    def __init__(self, found: set):
+        super().__init__()
+        self.found = found
+        self.posts = []
+        # ids of each query key
+        self.queries = []
+
+    def epost(self, ids: list, webenv=None) -> dict:
+        self.posts.append(list(ids))
+        self.queries.append(set(ids))
+        return {'Count': str(len(ids)), 'WebEnv': 'test',
+                'QueryKey': str(len(self.queries))}
+
+    def esearch(self, term: str, webenv=None) -> dict:
+        assert webenv == 'test'
+        ids = set()
+        for key in re.findall(r'#(\d+)', term):
+            ids.update(self.queries[int(key)-1])
+        self.queries.append(ids & self.found)
+        return {'Count': str(len(self.queries[-1])), 'WebEnv': webenv,
+                'QueryKey': str(len(self.queries))}
+
+
+def test_accession_file(tmp_path, monkeypatch):
+    accession_file = tmp_path / 'accessions.txt'
+    accession_file.write_text('# comment AB999999\n'
+                              'AB000001,AB000002.1 AB000003\n'
+                              '\n'
+                              ' AB000001  AB000004,\n'
+                              '#AB000005\n'
+                              'AB000006')
+    accessions = gb2fasta.read_accession_file(accession_file)
+    assert accessions == ['AB000001', 'AB000002.1', 'AB000003', 'AB000004',
+                          'AB000006']
+    # several posts are combined
+    monkeypatch.setattr(entrez, 'EPOST_MAX', 2)
+    client = FakePostClient({'AB000001', 'AB000003', 'AB000006'})
+    query = gb2fasta.search(client, accession_file=accession_file)
+    assert client.posts == [accessions[:2], accessions[2:4], accessions[4:]]
+    # count of found records
+    assert query['Count'] == '3'
+    assert query['WebEnv'] == 'test'
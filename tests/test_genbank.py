@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+from io import StringIO
+
+import pytest
+from Bio import SeqIO
+
+from OGU import genbank
+
+SEQUENCE = ('atgcgtacgtagctagctagcatcgatcgatgcatgcatgctagctagctacgatcgatcg'
+            'tagctagctagctgatcgatcgtagctagctagctagcgcgcgatatatcgcgatcgnnry'
+            'acgtacgatcgatcgatcgatgctagctagctagctagcgatcgatcgatcgatcgatcga'
+            'gctagctagctagtcgatcgatcgatgcatgcatcgatcgatcgatcgatcgatcgatgca')
+LOCATIONS = ['1..30', '5', '<1..>12', 'complement(40..95)',
+             'join(10..20,50..70)', 'complement(join(3..9,100..140))',
+             'join(complement(150..170),1..8)', 'order(30..40,60..65)',
+             '55..125']
+
+
+def make_gb(accession: str, sequence: str, locations: list,
+            comment=None) -> bytes:
+    """
+    Generate a genbank record with one gene for each location.
+    """
+    features = [f'     source          1..{len(sequence)}',
+                '                     /organism="Test test"']
+    for n, location in enumerate(locations):
+        features.append(f'     gene            {location}')
+        features.append(f'                     /gene="gene{n}"')
+    origin = []
+    for i in range(0, len(sequence), 60):
+        chunks = [sequence[j:j+10] for j in range(i, min(i+60, len(sequence)),
+                                                  10)]
+        origin.append(f'{i+1:>9} ' + ' '.join(chunks))
+    lines = [f'LOCUS       {accession:<16} {len(sequence):>11} bp    DNA     '
+             f'linear   PLN 01-JAN-2000',
+             'DEFINITION  Test test.',
+             f'ACCESSION   {accession}',
+             f'VERSION     {accession}.1',
+             'SOURCE      Test test',
+             '  ORGANISM  Test test',
+             '            Eukaryota; Viridiplantae.']
+    if comment is not None:
+        lines.append(f'COMMENT     {comment}')
+    lines.extend(['FEATURES             Location/Qualifiers', *features,
+                  'ORIGIN', *origin, '//', ''])
+    return '\n'.join(lines).encode('utf-8')
+
+
+def make_contig(accession: str, length: int) -> bytes:
+    """
+    Generate a CONTIG record without sequence, like WGS master records.
+    """
+    raw = make_gb(accession, 'a' * length, ['1..30'])
+    head = raw[:raw.index(b'ORIGIN')]
+    return head + f'CONTIG      join(AB000001.1:1..{length})\n//\n'.encode()
+
+
+def read_seqio(raw: bytes):
+    return SeqIO.read(StringIO(raw.decode('utf-8')), 'genbank')
+
+
+def test_extract_same_as_seqfeature():
+    raw = make_gb('AB000001', SEQUENCE, LOCATIONS)
+    expect = read_seqio(raw)
+    for record in (expect, genbank.scan_record(raw)):
+        data = genbank.get_data(record.seq)
+        assert len(record.features) == len(expect.features)
+        for feature, expect_feature in zip(record.features[1:],
+                                           expect.features[1:]):
+            parts = genbank.get_parts(feature.location)
+            assert genbank.extract(data, parts) == str(
+                expect_feature.extract(expect.seq))
+
+
+def test_extract_remote_part():
+    raw = make_gb('AB000001', SEQUENCE, ['join(AB000002.1:1..10,20..30)'])
+    record = read_seqio(raw)
+    parts = genbank.get_parts(record.features[1].location)
+    assert parts[0][3] == 'AB000002.1'
+    with pytest.raises(ValueError):
+        genbank.extract(genbank.get_data(record.seq), parts)
+
+
+@pytest.mark.skipif(genbank.LazySequence is None,
+                    reason='needs biopython>=1.79')
+@pytest.mark.parametrize('length', [1, 10, 59, 60, 61, 120, len(SEQUENCE)])
+def test_lazy_sequence_same_as_seqio(length):
+    raw = make_gb('AB000001', SEQUENCE[:length], [])
+    expect = str(read_seqio(raw).seq)
+    record = genbank.scan_record(raw)
+    assert isinstance(record.seq._data, genbank.LazySequence)
+    assert len(record.seq) == length
+    assert str(record.seq) == expect
+    for start, end in ((0, length), (1, length-1), (length//2, length),
+                       (59, 61), (5, 5)):
+        assert str(record.seq[start:end]) == expect[start:end]
+    assert str(record.seq.reverse_complement()) == str(
+        read_seqio(raw).seq.reverse_complement())
+
+
+@pytest.mark.parametrize('length', [0, 1, 60, 61, len(SEQUENCE)])
+def test_write_fasta(length):
+    raw = make_gb('AB000001', SEQUENCE[:length], [])
+    expect = read_seqio(raw)
+    expect.id = 'test'
+    expect.description = ''
+    for record in (read_seqio(raw), genbank.scan_record(raw)):
+        if record is None:
+            continue
+        for block in (1, 2, genbank.FASTA_BLOCK):
+            handle = StringIO()
+            genbank.write_fasta(handle, 'test', genbank.get_data(record.seq),
+                                block)
+            assert handle.getvalue() == expect.format('fasta')
+
+
+def test_index_round_trip(tmp_path):
+    records = [make_gb(f'AB00000{i}', SEQUENCE[:60*i+10], LOCATIONS[:i])
+               for i in range(1, 5)]
+    gbfile = tmp_path / 'test.gb'
+    gbfile.write_bytes(b''.join(records))
+    index = genbank.build_index(gbfile)
+    assert list(index) == [f'AB00000{i}.1' for i in range(1, 5)]
+    assert genbank.load_index(gbfile) == index
+    found = set()
+    selected = list(genbank.read_selected(
+        gbfile, ['AB000003', 'AB000001.1', 'XX000001'], found))
+    assert selected == [records[0], records[2]]
+    assert found == {'AB000003', 'AB000001.1'}
+    # changed file should not use old index
+    gbfile.write_bytes(b''.join(records[:2]))
+    assert genbank.load_index(gbfile) is None
+    assert list(genbank.read_selected(gbfile, ['AB000002'])) == [records[1]]
+
+
+def test_duplicate_filter():
+    duplicates = genbank.DuplicateFilter()
+    record = make_gb('AB000001', SEQUENCE, LOCATIONS)
+    assert duplicates.check(record) is None
+    assert duplicates.check(record) == 'AB000001.1'
+    # same accession with different sequence is kept
+    assert duplicates.check(make_gb('AB000001', SEQUENCE[:100], [])) is None
+    refseq = make_gb('NC_000001', SEQUENCE, [],
+                     'PROVISIONAL REFSEQ: This record has not yet been '
+                     'subject to final NCBI review. The reference sequence '
+                     'is identical to AB000001.')
+    assert duplicates.check(refseq) == 'AB000001.1'
+    # copy of other sequence
+    other = make_gb('NC_000002', SEQUENCE[:50], [],
+                    'REVIEWED REFSEQ: The reference sequence is identical '
+                    'to AB000002.')
+    assert duplicates.check(other) is None
+
+
+def test_get_data_undefined():
+    record = read_seqio(make_contig('AB000009', 100))
+    with pytest.raises(ValueError):
+        genbank.get_data(record.seq)
+
+
+def test_parse_qualifiers_escaped_quote():
+    lines = ['/product="tRNA-Leu (""trnL""', 'intron)"', '/note=""',
+             '/gene="""x"" y"']
+    assert genbank.parse_qualifiers(lines, {'product', 'note', 'gene'}) == {
+        'product': ['tRNA-Leu ("trnL" intron)'], 'note': [''],
+        'gene': ['"x" y']}
+    raw = make_gb('AB000001', SEQUENCE, ['1..30']).replace(
+        b'/gene="gene0"', b'/product="tRNA-Leu (""trnL""\n'
+        b'                     intron)"')
+    expect = read_seqio(raw).features[1].qualifiers['product']
+    assert genbank.scan_record(raw).features[1].qualifiers[
+        'product'] == expect
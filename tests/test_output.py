@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+from OGU import output
+
+
+def test_fasta_writer_eviction(tmp_path):
+    files = [tmp_path/f'{i}.fasta' for i in range(5)]
+    expect = {i: '' for i in files}
+    # tiny buffer and few handles, files are closed and opened again
+    with output.FastaWriter(max_handles=2, buffer_size=10,
+                            max_buffer=50) as writer:
+        for n in range(100):
+            filename = files[n*7 % len(files)]
+            text = f'>seq{n}\nACGT\n'
+            writer.write(filename, text)
+            expect[filename] += text
+        assert len(writer.handles) <= 2
+    for filename, text in expect.items():
+        assert filename.read_text() == text
+
+
+def test_fasta_writer_flush_on_close(tmp_path):
+    filename = tmp_path/'a.fasta'
+    writer = output.FastaWriter()
+    writer.write(filename, '>a\nACGT\n')
+    writer.close()
+    assert filename.read_text() == '>a\nACGT\n'
+
+def test_bgzf_round_trip(tmp_path):
+    filename = tmp_path/'a.fasta.gz'
+    # several blocks
+    lines = [f'>seq{n}\n{"ACGT"*50}\n' for n in range(2000)]
+    with output.open_file(filename, 'w', compress=True) as out:
+        out.write(''.join(lines[:1000]))
+    # append new members
+    with output.open_file(filename, 'a', compress=True) as out:
+        out.write(''.join(lines[1000:]))
+    assert output.is_compressed(filename)
+    with output.open_file(filename) as handle:
+        assert handle.read() == ''.join(lines)
+    # plain file
+    plain = tmp_path/'b.fasta'
+    output.decompress_file(filename, plain)
+    assert not output.is_compressed(plain)
+    with output.open_file(plain) as handle:
+        assert handle.read() == ''.join(lines)
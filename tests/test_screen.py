@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import random
+
+from OGU import screen
+
+
+def make_sequences(n: int, length: int, seed=0) -> list:
+    rand = random.Random(seed)
+    base = ''.join(rand.choice('ACGT') for _ in range(length))
+    sequences = []
+    for _ in range(n):
+        # a few substitutions
+        seq = list(base)
+        for i in rand.sample(range(length), length//50):
+            seq[i] = rand.choice('ACGT')
+        sequences.append(''.join(seq).encode())
+    return sequences
+
+
+def test_screen_normal():
+    sequences = make_sequences(20, 600)
+    assert all(i[0] is None for i in screen.screen(sequences))
+
+
+def test_screen_outliers():
+    sequences = make_sequences(30, 600)
+    sequences[3] = b'N' * 500 + sequences[3][500:]
+    sequences[5] = sequences[5] * 30
+    sequences[7] = b'AT' * 300
+    sequences[9] = sequences[9].lower()
+    reasons = screen.screen(sequences)
+    assert reasons[3][0] == 'ambiguous'
+    assert reasons[5][0] == 'length'
+    assert reasons[7][0] == 'kmer'
+    flagged = [n for n, i in enumerate(reasons) if i[0] is not None]
+    assert flagged == [3, 5, 7]
+
+
+def test_screen_chunks():
+    sequences = make_sequences(30, 600)
+    sequences[7] = b'AT' * 300
+    sequences.append(b'')
+    expect = screen.screen(sequences)
+    # chunks smaller than one sequence
+    for chunk in (1, 700, 5000):
+        assert screen.screen(sequences, chunk) == expect
+
+
+def test_screen_few_sequences():
+    assert screen.screen([]) == []
+    reasons = screen.screen([b'ACGT' * 200, b'NNNN' * 200, b'ACG'])
+    assert [i[0] for i in reasons] == [None, 'ambiguous', None]
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+
+import os
+
+from OGU import taxonomy
+
+
+def test_load_index_once(tmp_path):
+    index_file = tmp_path / 'taxonomy.idx'
+    id_parent = {1: 1, 2: 1, 3: 2, 4: 3, 5: 4, 6: 5, 7: 6}
+    id_rank = {2: 'superkingdom', 3: 'phylum', 4: 'class', 5: 'order',
+               6: 'family', 7: 'species'}
+    id_name = {2: 'Eukaryota', 3: 'Streptophyta', 4: 'Magnoliopsida',
+               5: 'Fabales', 6: 'Fabaceae', 7: 'Test test'}
+    taxonomy.write_index(id_parent, id_rank, id_name, index_file)
+    index = taxonomy.load_index(index_file)
+    assert index.get_ranks(7) == ('Eukaryota', 'Streptophyta',
+                                  'Magnoliopsida', 'Fabales', 'Fabaceae')
+    assert index.get_ranks(100) is None
+    opened = len(os.listdir('/proc/self/fd')) if os.path.isdir(
+        '/proc/self/fd') else None
+    # divide calls it for each file and shard
+    for _ in range(20):
+        assert taxonomy.load_index(index_file) is index
+    if opened is not None:
+        assert len(os.listdir('/proc/self/fd')) == opened